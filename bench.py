@@ -0,0 +1,562 @@
+import argparse
+import ctypes
+import ctypes.util
+import errno
+import heapq
+import json
+import os
+import platform
+import random
+import select
+import socket
+import struct
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import hgpriv
+import libnetat
+
+# Benchmarks for server.py, hgpriv.py and libnetat.py without Taixin hardware.
+# A fake iwpriv node (a fifo under a temp proc root) stands in for the driver and
+# a UDP simulator answers netat scan/AT and netlog requests for a fleet of modules.
+# hgpriv reopens a fifo on every call, --iwpriv-node fuse serves the node from a small
+# fuse filesystem instead (root only) so the kept fd pwrite/preadv path is measured.
+#
+#   python bench.py                      all benchmarks, results in bench_output.txt
+#   python bench.py --only fleet,scan --fleet-size 200 --loss 0.02 --latency-ms 5
+#   sudo python bench.py --only command_hgpriv --iwpriv-node fuse
+
+BENCHMARKS = ['command_hgpriv', 'command_libnetat', 'index_render', 'config_apply', 'scan', 'fleet', 'netlog']
+DEFAULT_OUTPUT = 'bench_output.txt'
+CONFIG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'etc', 'hgicf.conf')
+COMMAND_PARAMS = ['temperature', 'signal', 'txpower', 'freq_offset']
+NETLOG_LINE_GAP = 20e-6  # seconds between simulated netlog datagrams
+IWPRIV_NODES = ['fifo', 'fuse']
+
+# just enough of the fuse protocol for one file that answers like the hgic driver
+FUSE_IN_HEADER = struct.Struct('<IIQQIIIHH')
+FUSE_OUT_HEADER = struct.Struct('<IiQ')
+FUSE_ATTR = struct.Struct('<QQQQQQIIIIIIIIII')
+FUSE_INIT_OUT = struct.Struct('<IIIIHHIIHHII24x')
+FUSE_RW_IN = struct.Struct('<QQII')
+FUSE_LOOKUP, FUSE_FORGET, FUSE_GETATTR, FUSE_SETATTR = 1, 2, 3, 4
+FUSE_OPEN, FUSE_READ, FUSE_WRITE, FUSE_RELEASE, FUSE_FLUSH = 14, 15, 16, 18, 25
+FUSE_INIT, FUSE_INTERRUPT, FUSE_DESTROY, FUSE_BATCH_FORGET = 26, 36, 38, 42
+FOPEN_DIRECT_IO = 1
+FUSE_MAX_WRITE = 128 * 1024
+MNT_DETACH = 2
+
+def device_values(rng, index=0):
+    return {
+        'signal': str(rng.randint(-85, -40)),
+        'rssi': str(rng.randint(-85, -40)),
+        'conn_state': '9',
+        'ssid': 'bench',
+        'bssid': f"02:00:00:00:{index >> 8:02x}:{index & 0xff:02x}",
+        'txpower': '20',
+        'bss_bw': '8',
+        'temperature': str(rng.randint(35, 55)),
+        'battery_level': '100',
+        'freq_offset': str(rng.randint(-5, 5)),
+        'sta_count': '0',
+        'mode': 'sta',
+        'key_mgmt': 'WPA-PSK',
+    }
+
+class FakeIwpriv:
+    # answers "ifname get/set param" written to <root>/iwpriv like the hgic driver does:
+    # a little endian length followed by the reply text
+    def __init__(self, latency_ms=0.0, seed=0, scan_rows=32):
+        self.root = tempfile.mkdtemp(prefix='hgic_bench_')
+        self.path = os.path.join(self.root, 'iwpriv')
+        self.latency = latency_ms / 1000
+        self.rng = random.Random(seed)
+        self.values = device_values(self.rng)
+        self.values['scan_list'] = 'BSSID\tSSID\tENCRYPTION\tFREQUENCY\tSIGNAL\n' + '\n'.join(
+            f"02:00:00:01:{i >> 8:02x}:{i & 0xff:02x}\tap{i}\tWPA\t{9080 + i % 16 * 10}\t{self.rng.randint(-90, -40)}"
+            for i in range(scan_rows))
+        self.requests = 0
+        self.start()
+
+    def start(self):
+        os.mkfifo(self.path)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def reply(self, cmd):
+        parts = cmd.decode(errors='ignore').split(None, 2)
+        if len(parts) < 3:
+            return b'invalid command'
+        if parts[1] == 'set':
+            key, _, value = parts[2].partition('=')
+            self.values[key] = value
+            return b'OK'
+        return self.values.get(parts[2].strip(), '0').encode()
+
+    def answer(self, cmd):
+        self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+        reply = self.reply(cmd)
+        return struct.pack('<I', len(reply)) + reply
+
+    def run(self):
+        while True:
+            with open(self.path, 'rb') as f:
+                cmd = f.read()
+            if not cmd:
+                continue
+            reply = self.answer(cmd)
+            with open(self.path, 'wb') as f:
+                f.write(reply)
+
+    def close(self):
+        pass
+
+class FuseIwpriv(FakeIwpriv):
+    # the same answers from a regular looking file: a write stores the command, the next read
+    # on that handle returns the reply. unlike a fifo it can be kept open and used with pwrite/preadv
+    ROOT_NODE = 1
+    FILE_NODE = 2
+
+    def start(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = os.open('/dev/fuse', os.O_RDWR)
+        options = f"fd={self.fd},rootmode=40000,user_id={os.getuid()},group_id={os.getgid()}"
+        if self.libc.mount(b'hgic_bench', self.root.encode(), b'fuse', 0, options.encode()) != 0:
+            os.close(self.fd)
+            raise OSError(ctypes.get_errno(), f"fuse mount on {self.root} failed (needs root)")
+        self.replies = {}
+        self.handles = 0
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def attr(self, node):
+        now = int(time.time())
+        if node == self.ROOT_NODE:
+            return FUSE_ATTR.pack(node, 0, 0, now, now, now, 0, 0, 0, 0o40755, 2, 0, 0, 0, 4096, 0)
+        return FUSE_ATTR.pack(node, 0, 0, now, now, now, 0, 0, 0, 0o100666, 1, 0, 0, 0, 4096, 0)
+
+    def handle(self, opcode, node, body):
+        # returns (errno, payload), None for requests that get no reply
+        if opcode == FUSE_INIT:
+            major, minor = struct.unpack_from('<II', body)
+            return 0, FUSE_INIT_OUT.pack(7, min(minor, 31), 0, 0, 16, 12, FUSE_MAX_WRITE, 1, 0, 0, 0, 0)
+        if opcode == FUSE_LOOKUP:
+            if node != self.ROOT_NODE or bytes(body).rstrip(b'\0') != b'iwpriv':
+                return errno.ENOENT, b''
+            return 0, struct.pack('<QQQQII', self.FILE_NODE, 0, 1, 1, 0, 0) + self.attr(self.FILE_NODE)
+        if opcode in (FUSE_GETATTR, FUSE_SETATTR):
+            return 0, struct.pack('<QII', 1, 0, 0) + self.attr(node)
+        if opcode == FUSE_OPEN:
+            self.handles += 1
+            return 0, struct.pack('<QII', self.handles, FOPEN_DIRECT_IO, 0)
+        if opcode == FUSE_WRITE:
+            fh, offset, size, _ = FUSE_RW_IN.unpack_from(body)
+            self.replies[fh] = self.answer(bytes(body[40:40 + size]))
+            return 0, struct.pack('<II', size, 0)
+        if opcode == FUSE_READ:
+            fh, offset, size, _ = FUSE_RW_IN.unpack_from(body)
+            return 0, self.replies.get(fh, b'')[offset:offset + size]
+        if opcode == FUSE_RELEASE:
+            fh = struct.unpack_from('<Q', body)[0]
+            self.replies.pop(fh, None)
+            return 0, b''
+        if opcode == FUSE_FLUSH:
+            return 0, b''
+        if opcode in (FUSE_FORGET, FUSE_BATCH_FORGET, FUSE_INTERRUPT):
+            return None
+        return errno.ENOSYS, b''
+
+    def run(self):
+        while True:
+            try:
+                request = os.read(self.fd, FUSE_MAX_WRITE + 4096)
+            except OSError as e:
+                if e.errno in (errno.EINTR, errno.EAGAIN, errno.ENOENT):
+                    continue
+                break  # unmounted
+            if len(request) < FUSE_IN_HEADER.size:
+                break
+            length, opcode, unique, node = FUSE_IN_HEADER.unpack_from(request)[:4]
+            try:
+                result = self.handle(opcode, node, memoryview(request)[FUSE_IN_HEADER.size:length])
+            except Exception as e:
+                # a dead server thread would hang every caller, fail the request instead
+                print(f"Fake iwpriv could not handle opcode {opcode}: {e}")
+                result = errno.EIO, b''
+            if opcode == FUSE_DESTROY:
+                break
+            if result is None:
+                continue
+            error, payload = result
+            payload = b'' if error else payload
+            try:
+                os.write(self.fd, FUSE_OUT_HEADER.pack(FUSE_OUT_HEADER.size + len(payload), -error, unique) + payload)
+            except OSError:
+                pass
+
+    def close(self):
+        self.libc.umount2(self.root.encode(), MNT_DETACH)
+        os.close(self.fd)
+
+class NetatSimulator:
+    # a fleet of modules behind one UDP socket for netat and one for netlog.
+    # replies are scheduled on a heap so slow modules do not hold up the others
+    def __init__(self, fleet_size, latency_ms=1.0, jitter_ms=0.0, loss=0.0, seed=0, log_lines=0):
+        self.rng = random.Random(seed)
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.loss = loss
+        self.log_lines = log_lines
+        self.devices = {bytes([2, 0, 0, 0, i >> 8, i & 0xff]): device_values(self.rng, i) for i in range(fleet_size)}
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.address = self.sock.getsockname()
+        self.netlog_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.netlog_sock.bind(('127.0.0.1', 0))
+        self.netlog_address = self.netlog_sock.getsockname()
+        self.queue = []
+        self.seq = 0
+        self.received = 0
+        self.dropped = 0
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def schedule(self, sock, data, addr, delay=None):
+        if self.loss and self.rng.random() < self.loss:
+            self.dropped += 1
+            return
+        if delay is None:
+            delay = self.latency + self.rng.random() * self.jitter
+        self.seq += 1
+        heapq.heappush(self.queue, (time.monotonic() + delay, self.seq, sock, data, addr))
+
+    def at_reply(self, values, atcmd):
+        atcmd = atcmd.decode(errors='ignore').strip().rstrip('\x00')
+        if not atcmd.lower().startswith('at+'):
+            return b'ERROR\r\n'
+        body = atcmd[3:]
+        if body.endswith('?'):
+            key = body[:-1].lower()
+            return f"+{key.upper()}:{values.get(key, '0')}\r\nOK\r\n".encode()
+        key, _, value = body.partition('=')
+        values[key.lower()] = value
+        return b'OK\r\n'
+
+    def netat_received(self, data, addr):
+        cmd = libnetat.WnbNetatCmd.from_bytes(data)
+        if cmd.cmd == libnetat.WNB_NETAT_CMD_SCAN_REQ:
+            for mac in self.devices:
+                reply = libnetat.WnbNetatCmd(libnetat.WNB_NETAT_CMD_SCAN_RESP, cmd.src, mac)
+                self.schedule(self.sock, reply.to_bytes(), addr)
+        elif cmd.cmd == libnetat.WNB_NETAT_CMD_AT_REQ:
+            targets = self.devices if cmd.dest == libnetat.BROADCAST_MAC else [cmd.dest] if cmd.dest in self.devices else []
+            for mac in targets:
+                reply = libnetat.WnbNetatCmd(libnetat.WNB_NETAT_CMD_AT_RESP, cmd.src, mac, self.at_reply(self.devices[mac], cmd.data))
+                self.schedule(self.sock, reply.to_bytes(), addr)
+
+    def netlog_received(self, data, addr):
+        # answer the announce from every module, then send each one's log lines
+        announce = libnetat.WnbModuleNetlog.from_bytes(data)
+        for index, mac in enumerate(self.devices):
+            reply = libnetat.WnbModuleNetlog(mac, announce.cookie, 0, int(time.time()), announce.port)
+            self.schedule(self.netlog_sock, reply.to_bytes(), addr)
+            for line in range(self.log_lines):
+                text = f"[{index}] bench log line {line} rssi={self.devices[mac]['signal']}\n".encode()
+                # paced at NETLOG_LINE_GAP so the burst does not just measure the socket buffer
+                self.schedule(self.netlog_sock, text, addr, self.latency * 2 + (index * self.log_lines + line) * NETLOG_LINE_GAP)
+
+    def run(self):
+        while self.running:
+            now = time.monotonic()
+            while self.queue and self.queue[0][0] <= now:
+                _, _, sock, data, addr = heapq.heappop(self.queue)
+                try:
+                    sock.sendto(data, addr)
+                except OSError:
+                    pass
+            timeout = max(self.queue[0][0] - now, 0) if self.queue else 0.05
+            readable, _, _ = select.select([self.sock, self.netlog_sock], [], [], timeout)
+            for sock in readable:
+                try:
+                    data, addr = sock.recvfrom(libnetat.NETAT_BUFF_SIZE)
+                except OSError:
+                    continue
+                self.received += 1
+                try:
+                    if sock is self.sock:
+                        self.netat_received(data, addr)
+                    elif len(data) >= 23:
+                        self.netlog_received(data, addr)
+                except Exception as e:
+                    print(f"Simulator could not handle packet: {e}")
+
+    def mgr(self):
+        return libnetat.NetatMgr(None, port=0, target=self.address)
+
+    def close(self):
+        self.running = False
+        self.thread.join()
+        self.sock.close()
+        self.netlog_sock.close()
+
+def stats(samples):
+    if not samples:
+        return {'count': 0}
+    ordered = sorted(samples)
+
+    def percentile(p):
+        return round(ordered[min(int(len(ordered) * p), len(ordered) - 1)], 3)
+
+    return {
+        'count': len(ordered),
+        'mean_ms': round(sum(ordered) / len(ordered), 3),
+        'min_ms': round(ordered[0], 3),
+        'p50_ms': percentile(0.5),
+        'p90_ms': percentile(0.9),
+        'p99_ms': percentile(0.99),
+        'max_ms': round(ordered[-1], 3),
+    }
+
+def timed(fn, iterations):
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+def throughput(fn, requests, threads):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        list(pool.map(lambda _: fn(), range(requests)))
+    elapsed = time.perf_counter() - start
+    return {'threads': threads, 'requests': requests, 'elapsed_s': round(elapsed, 3), 'per_s': round(requests / elapsed, 1)}
+
+class Bench:
+    def __init__(self, args):
+        self.args = args
+        self.state_dir = tempfile.mkdtemp(prefix='taixin_bench_')
+        node = FuseIwpriv if args.iwpriv_node == 'fuse' else FakeIwpriv
+        self.iwpriv = node(args.iwpriv_latency_ms, args.seed)
+        self.sim = NetatSimulator(args.fleet_size, args.latency_ms, args.jitter_ms, args.loss, args.seed, args.log_lines)
+        # through the environment, so hgpriv finds the node again after it drops the device on an error
+        os.environ['HGIC_PROC_ROOT'] = self.iwpriv.root
+        hgpriv.reset_device()
+        hgpriv.IWPRIV_LOCK_FILE = os.path.join(self.state_dir, 'iwpriv.lock')
+
+        import server
+        self.server = server
+        server.MODE_FILE = os.path.join(self.state_dir, 'mode.conf')
+        server.SHARED_STATE_DIR = os.path.join(self.state_dir, 'shared')
+        server.HISTORY_DIR = os.path.join(self.state_dir, 'history')
+        server.NETLOG_DIR = os.path.join(self.state_dir, 'netlog')
+        server.CURRENT_SETTINGS_FILE = CONFIG_FILE
+        server.NETAT_SESSIONS[server.IFNAME] = server.NetatSession(server.IFNAME, self.sim.mgr())
+        self.client = server.app.test_client()
+
+    def set_mode(self, mode):
+        self.server.save_mode(mode)
+        self.server.status_sampler.invalidate()
+
+    def command(self, mode):
+        self.set_mode(mode)
+        params = COMMAND_PARAMS
+        counter = iter(range(sys.maxsize))
+
+        def request():
+            param = params[next(counter) % len(params)]
+            response = self.client.get(f"/command?cmd=get&param={param}")
+            if response.status_code != 200:
+                raise RuntimeError(f"/command returned {response.status_code}")
+
+        request()  # first call opens the session / picks the device
+        result = {'latency': stats(timed(request, self.args.iterations))}
+        result['concurrent'] = throughput(request, self.args.iterations, self.args.threads)
+        return result
+
+    def command_hgpriv(self):
+        before = self.iwpriv.requests
+        result = self.command('hgpriv')
+        result['driver_calls'] = self.iwpriv.requests - before
+        device = hgpriv.get_device()
+        result['iwpriv_node'] = 'fuse' if isinstance(self.iwpriv, FuseIwpriv) else 'fifo'
+        result['kept_fd'] = device.reuse if device is not None else None
+        result['coalesced'] = hgpriv.iwpriv_broker.coalesced
+        return result
+
+    def command_libnetat(self):
+        return self.command('libnetat')
+
+    def index_render(self):
+        self.set_mode('hgpriv')
+
+        def render():
+            response = self.client.get('/')
+            if response.status_code != 200:
+                raise RuntimeError(f"/ returned {response.status_code}")
+
+        render()
+        cached = stats(timed(render, self.args.iterations))
+
+        def cold():
+            self.server.status_sampler.invalidate()
+            render()
+
+        return {'cached': cached, 'cold': stats(timed(cold, max(self.args.iterations // 4, 1)))}
+
+    def config_apply(self):
+        settings = self.server.load_station_settings()
+        result = {'keys': len(settings)}
+        for mode in self.server.MODES:
+            self.set_mode(mode)
+            iterations = max(self.args.iterations // 10, 3)
+            result[mode] = {
+                'reconcile': stats(timed(lambda: self.server.apply_settings(settings), iterations)),
+                'force': stats(timed(lambda: self.server.apply_settings(settings, force=True), iterations)),
+            }
+        return result
+
+    def scan(self):
+        mgr = self.sim.mgr()
+        samples = []
+        found = []
+        for _ in range(max(self.args.iterations // 20, 3)):
+            start = time.perf_counter()
+            devices = mgr.netat_discover()
+            samples.append((time.perf_counter() - start) * 1000)
+            found.append(len(devices))
+        mgr.sock.close()
+        return {'fleet_size': self.args.fleet_size, 'found_min': min(found), 'found_max': max(found), 'time': stats(samples)}
+
+    def fleet(self):
+        mgr = self.sim.mgr()
+        devices = mgr.netat_discover()
+        commands = ['at+rssi?', 'at+txpower?', 'at+txpower=20', 'at+ssid?']
+        runs = []
+        for _ in range(3):
+            report = mgr.netat_fleet(commands, devices)
+            replies = sum(1 for device in report['devices'] for result in device['results'] if result['response'])
+            sent = len(devices) * len(commands)
+            runs.append({
+                'elapsed_ms': round(report['elapsed_ms'], 3),
+                'commands': sent,
+                'replies': replies,
+                'commands_per_s': round(sent / (report['elapsed_ms'] / 1000), 1) if report['elapsed_ms'] else None,
+                'failed_devices': sum(1 for device in report['devices'] if not device['ok']),
+            })
+        mgr.sock.close()
+        return {'devices': len(devices), 'runs': runs,
+                'best_commands_per_s': max(run['commands_per_s'] or 0 for run in runs)}
+
+    def netlog(self):
+        # every simulated module logs from the same address, so only the line total is checked
+        expected = self.args.fleet_size * self.args.log_lines
+        collector = libnetat.NetlogCollector(None, port=0, ring_size=max(expected, libnetat.NETLOG_RING_SIZE),
+                                             target=self.sim.netlog_address)
+        start = time.perf_counter()
+        collector.start()
+        received = 0
+        last = start
+        # wait until every line arrived or nothing new came in for a second
+        while received < expected and time.perf_counter() - last < 1:
+            time.sleep(0.005)
+            count = sum(collector.devices().values())
+            if count != received:
+                received = count
+                last = time.perf_counter()
+        elapsed = last - start
+        collector.close()
+        return {'expected_lines': expected, 'received_lines': received, 'elapsed_s': round(elapsed, 3),
+                'lines_per_s': round(received / elapsed, 1) if elapsed else None}
+
+    def run(self, names):
+        results = {}
+        for name in names:
+            print(f"running {name}...", flush=True)
+            start = time.perf_counter()
+            try:
+                results[name] = getattr(self, name)()
+            except Exception as e:
+                results[name] = {'error': f"{type(e).__name__}: {e}"}
+            results[name]['wall_s'] = round(time.perf_counter() - start, 3)
+        return results
+
+    def close(self):
+        self.sim.close()
+        if hgpriv.hgic_device is not None:
+            hgpriv.hgic_device.close()
+        hgpriv.reset_device()
+        self.iwpriv.close()
+
+def summary_line(name, result):
+    if 'error' in result:
+        return f"{name}: {result['error']}"
+    if name.startswith('command_'):
+        latency = result['latency']
+        line = f"{name}: p50 {latency['p50_ms']} ms, p99 {latency['p99_ms']} ms, {result['concurrent']['per_s']} req/s with {result['concurrent']['threads']} threads"
+        if 'iwpriv_node' in result:
+            line += f", {result['iwpriv_node']} node{' (kept fd)' if result['kept_fd'] else ''}"
+        return line
+    if name == 'index_render':
+        return f"{name}: cached p50 {result['cached']['p50_ms']} ms, cold p50 {result['cold']['p50_ms']} ms"
+    if name == 'config_apply':
+        return f"{name}: " + ', '.join(f"{mode} reconcile p50 {result[mode]['reconcile']['p50_ms']} ms" for mode in result if isinstance(result[mode], dict))
+    if name == 'scan':
+        return f"{name}: {result['found_max']}/{result['fleet_size']} devices, p50 {result['time']['p50_ms']} ms"
+    if name == 'fleet':
+        return f"{name}: {result['devices']} devices, {result['best_commands_per_s']} commands/s"
+    if name == 'netlog':
+        return f"{name}: {result['received_lines']}/{result['expected_lines']} lines, {result['lines_per_s']} lines/s"
+    return f"{name}: {result}"
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks against a simulated HaLow module")
+    parser.add_argument('--only', help=f"comma separated subset of {','.join(BENCHMARKS)}")
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--threads', type=int, default=8, help="client threads for the throughput runs")
+    parser.add_argument('--fleet-size', type=int, default=50)
+    parser.add_argument('--latency-ms', type=float, default=2.0, help="simulated module reply latency")
+    parser.add_argument('--jitter-ms', type=float, default=1.0)
+    parser.add_argument('--loss', type=float, default=0.0, help="fraction of simulated replies dropped")
+    parser.add_argument('--iwpriv-node', choices=IWPRIV_NODES, default='fifo',
+                        help="fake driver node, fuse keeps one fd open like the real proc node (needs root)")
+    parser.add_argument('--iwpriv-latency-ms', type=float, default=0.2, help="simulated driver latency")
+    parser.add_argument('--log-lines', type=int, default=20, help="netlog lines sent by each simulated module")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', default=DEFAULT_OUTPUT)
+    args = parser.parse_args()
+
+    names = args.only.split(',') if args.only else BENCHMARKS
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        print(f"Unknown benchmark: {', '.join(unknown)}")
+        return 1
+
+    bench = Bench(args)
+    try:
+        results = bench.run(names)
+    finally:
+        bench.close()
+
+    report = {
+        'time': time.time(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'config': vars(args),
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    for name, result in results.items():
+        print(summary_line(name, result))
+    print(f"results written to {args.output}")
+    return 1 if any('error' in result for result in results.values()) else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
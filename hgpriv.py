@@ -1,14 +1,39 @@
 import os
+import re
+import base64
+import binascii
 import sys
+import errno
+import stat
 import socket
 import struct
 import fcntl
+import queue
+import threading
+import contextlib
+
+try:
+    from tracing import span as trace_span
+except ImportError:
+    def trace_span(name, **args):
+        return contextlib.nullcontext()
 
 # Constants and Macros
 MACSTR = "{:02x}:{:02x}:{:02x}:{:02x}:{:02x}:{:02x}"
 IPSTR = "{}.{}.{}.{}.{}"
 HGIC = "hgics"
+IFNAME = "hg0"
 blenc_mode = 0
+IWPRIV_LOCK_FILE = "/tmp/hgic_iwpriv.lock"
+IWPRIV_BUFF_SIZE = 4096 + 256  # reply buffer, grown on demand for larger requests
+IWPRIV_TIMEOUT = 5  # seconds a broker caller waits for its reply
+# gets whose reply is binary and must not be decoded as text
+BINARY_GETS = ['wkdata_buff', 'driverdata', 'cust_drvdata', 'mgmtframe']
+OUTPUT_FORMATS = ['text', 'hex', 'base64']
+
+iwpriv_thread_lock = threading.Lock()
+iwpriv_lock_fd = None
+iwpriv_lock_pid = None
 
 # Helper functions
 def MAC2STR(mac):
@@ -86,30 +111,360 @@ def hgic_proc_read_bytes(buff_len):
     except IOError:
         return b''
 
-def hgic_iwpriv_do(cmd, in_data=None, in_len=0, out_len=4096):
-    ret = len(cmd)
-    len_total = ret + MAX(in_len, out_len)
-    buff = bytearray(len_total)
+@contextlib.contextmanager
+def iwpriv_locked():
+    # the driver keeps one reply buffer, so a write/read pair must not interleave
+    # with another thread or process talking to the same proc node
+    global iwpriv_lock_fd, iwpriv_lock_pid
+    with iwpriv_thread_lock:
+        if iwpriv_lock_pid != os.getpid():
+            # a forked child must take its own flock, not share the parent's
+            iwpriv_lock_pid = os.getpid()
+            try:
+                iwpriv_lock_fd = os.open(IWPRIV_LOCK_FILE, os.O_RDWR | os.O_CREAT, 0o666)
+            except OSError as e:
+                print(f"Open {IWPRIV_LOCK_FILE} fail: {e}")
+                iwpriv_lock_fd = None
+        if iwpriv_lock_fd is not None:
+            fcntl.flock(iwpriv_lock_fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if iwpriv_lock_fd is not None:
+                fcntl.flock(iwpriv_lock_fd, fcntl.LOCK_UN)
 
-    if in_data and in_len:
-        cmd_bytes = cmd.encode() + in_data[:in_len]
-    else:
-        cmd_bytes = cmd.encode()
+class HgicDevice:
+    # resolves the proc root once and keeps the iwpriv node open between calls.
+    # replies are read into a preallocated buffer and returned as memoryview slices,
+    # which are only valid until the next call on the same device
+    def __init__(self, root=None):
+        self.root = root or self.find_root()
+        self.path = os.path.join(self.root, "iwpriv")
+        self.fd = None
+        # a fifo (fake driver) has no offsets and needs separate open/close per direction
+        self.reuse = not stat.S_ISFIFO(os.stat(self.path).st_mode)
+        self.buff = bytearray(IWPRIV_BUFF_SIZE)
+        self.view = memoryview(self.buff)
 
-    ret = hgic_iwpriv_write(cmd_bytes)
-    if ret > 0:
-        response = hgic_proc_read_bytes(len_total)
-        if response:
-            ret = int.from_bytes(response[:4], 'little')
+    @staticmethod
+    def find_root():
+        for name in ("hgicf", "hgics"):
+            if os.path.exists(f"/proc/{name}/iwpriv"):
+                return f"/proc/{name}"
+        return None
+
+    def reserve(self, size):
+        if size > len(self.buff):
+            self.view.release()
+            self.buff = bytearray(size)
+            self.view = memoryview(self.buff)
+
+    def transfer(self, length, total):
+        # one fd with positional io when the node supports it, otherwise reopen per call
+        if self.reuse:
+            try:
+                if self.fd is None:
+                    self.fd = os.open(self.path, os.O_RDWR)
+                with trace_span('proc_write', bytes=length):
+                    os.pwrite(self.fd, self.view[:length], 0)
+                with trace_span('proc_read'):
+                    count = os.preadv(self.fd, [self.view[:total]], 0)
+                if count > 0:
+                    return count
+                # nothing on the kept fd, retry this call on a fresh open and reopen next time
+                self.close()
+            except OSError as e:
+                self.close()
+                if e.errno not in (errno.ESPIPE, errno.EINVAL, errno.EACCES, errno.EPERM):
+                    raise
+                self.reuse = False
+        with trace_span('proc_write', bytes=length):
+            fd = os.open(self.path, os.O_WRONLY)
+            try:
+                os.write(fd, self.view[:length])
+            finally:
+                os.close(fd)
+        with trace_span('proc_read'), open(self.path, 'rb', buffering=0) as f:
+            return f.readinto(self.view[:total])
+
+    def iwpriv(self, cmd, in_data=None, in_len=0, out_len=4096, copy=False):
+        cmd_bytes = cmd.encode()
+        length = len(cmd_bytes) + (in_len if in_data and in_len else 0)
+        total = len(cmd_bytes) + MAX(in_len, out_len)
+        with trace_span('iwpriv', cmd=cmd), iwpriv_locked():
+            self.reserve(MAX(length, total))
+            self.view[:len(cmd_bytes)] = cmd_bytes
+            if length > len(cmd_bytes):
+                self.view[len(cmd_bytes):length] = memoryview(in_data)[:in_len]
+            try:
+                count = self.transfer(length, total)
+            except OSError as e:
+                print(f"iwpriv {self.path} fail: {e}")
+                # e.g. EIO after a driver reload, resolve and open the node again on the next call
+                self.close()
+                reset_device(self)
+                return -1, b''
+            if count <= 0:
+                print("No response received from iwpriv")
+                return len(cmd_bytes), b''
+            ret = int.from_bytes(self.view[:4], 'little')
             if ret > 0 and out_len > 0:
-                return ret, response[4:4 + ret]
-            return ret, response
-        else:
-            print("No response received from iwpriv")
-    else:
+                response = self.view[4:4 + ret]
+            else:
+                response = self.view[:count]
+            return ret, bytes(response) if copy else response
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+hgic_device = None
+
+def get_device():
+    # HGIC_PROC_ROOT points the library at another proc root, e.g. a fake node for benchmarks
+    global hgic_device, HGIC
+    if hgic_device is None:
+        root = os.environ.get("HGIC_PROC_ROOT") or HgicDevice.find_root()
+        if root is None or not os.path.exists(os.path.join(root, "iwpriv")):
+            return None
+        try:
+            hgic_device = HgicDevice(root)
+        except OSError:
+            return None
+        HGIC = os.path.basename(root)
+    return hgic_device
+
+def reset_device(device=None):
+    global hgic_device
+    if device is None or hgic_device is device:
+        hgic_device = None
+
+def hgic_iwpriv_do(cmd, in_data=None, in_len=0, out_len=4096):
+    device = get_device()
+    if device is None:
         print(f"Failed to write command '{cmd}'")
+        return -1, b''
+    # copied, the reply may be shared between threads
+    return device.iwpriv(cmd, in_data, in_len, out_len, copy=True)
+
+class IwprivRequest:
+    def __init__(self, cmd, in_data, in_len, out_len, key):
+        self.cmd = cmd
+        self.in_data = in_data
+        self.in_len = in_len
+        self.out_len = out_len
+        self.key = key
+        self.done = threading.Event()
+        self.result = (-1, b'')
+
+class IwprivBroker:
+    # one thread owns the proc node and runs write/read pairs in queue order.
+    # identical gets that are still queued or running share one driver call
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.queue = None
+        self.thread = None
+        self.pid = None
+        self.calls = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.timeouts = 0
+
+    def start(self):
+        # the worker thread does not survive a fork, start a fresh one in the child.
+        # the counters start over too, server.py adds up every worker's and the parent's calls are not ours
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.pending = {}
+            self.calls = self.coalesced = self.errors = self.timeouts = 0
+            self.queue = queue.Queue()
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def submit(self, cmd, in_data=None, in_len=0, out_len=4096):
+        parts = cmd.split()
+        key = (cmd, out_len) if len(parts) > 1 and parts[1] == 'get' and not in_data else None
+        with self.lock:
+            self.start()
+            if key is not None and key in self.pending:
+                self.coalesced += 1
+                return self.pending[key]
+            request = IwprivRequest(cmd, in_data, in_len, out_len, key)
+            if key is not None:
+                self.pending[key] = request
+            self.queue.put(request)
+        return request
+
+    def call(self, cmd, in_data=None, in_len=0, out_len=4096, timeout=IWPRIV_TIMEOUT):
+        with trace_span('iwpriv_broker', cmd=cmd):
+            request = self.submit(cmd, in_data, in_len, out_len)
+            done = request.done.wait(timeout)
+        if not done:
+            self.timeouts += 1
+            print(f"Timed out waiting for '{cmd}'")
+            return -1, b''
+        return request.result
+
+    def run(self):
+        while True:
+            request = self.queue.get()
+            try:
+                request.result = hgic_iwpriv_do(request.cmd, request.in_data, request.in_len, request.out_len)
+            except Exception as e:
+                print(f"iwpriv '{request.cmd}' failed: {e}")
+            with self.lock:
+                self.calls += 1
+                if request.result[0] < 0:
+                    self.errors += 1
+                if self.pending.get(request.key) is request:
+                    del self.pending[request.key]
+            request.done.set()
+
+iwpriv_broker = IwprivBroker()
+
+# Response parsers
+INT_RE = re.compile(r'-?\d+')
+NUMBER_RE = re.compile(r'-?\d+(?:\.\d+)?')
+MAC_RE = re.compile(r'(?:[0-9a-fA-F]{2}:){5}[0-9a-fA-F]{2}')
+FIELD_RE = re.compile(r'([A-Za-z_]\w*)\s*[:=]\s*([^\s,;:=]+)')
+
+def parse_int(text):
+    match = INT_RE.search(text)
+    return int(match.group(0)) if match else None
 
-    return ret, b''
+def parse_number(text):
+    match = NUMBER_RE.search(text)
+    if not match:
+        return None
+    value = match.group(0)
+    return float(value) if '.' in value else int(value)
+
+def parse_field(value):
+    if NUMBER_RE.fullmatch(value):
+        return parse_number(value)
+    return value
+
+def parse_fields(text):
+    return {key: parse_field(value) for key, value in FIELD_RE.findall(text)}
+
+def parse_conn_state(text):
+    state = parse_int(text)
+    if state is None:
+        return None
+    return {'state': state, 'name': hgic_hw_state(state)}
+
+def parse_scan_list(text):
+    # bssid, ssid, encryption, frequency, signal separated by tabs, after a header line
+    rows = []
+    for line in text.splitlines():
+        cols = [col.strip() for col in line.split('\t')]
+        if len(cols) < 5 or not MAC_RE.fullmatch(cols[0]):
+            continue
+        rows.append({
+            'bssid': cols[0].lower(),
+            'ssid': cols[1],
+            'encryption': cols[2],
+            'frequency': parse_number(cols[3]),
+            'signal': parse_int(cols[4]),
+        })
+    return rows
+
+def parse_sta_list(text):
+    stations = []
+    for line in text.splitlines():
+        match = MAC_RE.search(line)
+        if not match:
+            continue
+        station = {'mac': match.group(0).lower()}
+        rest = line[:match.start()] + line[match.end():]
+        station.update(parse_fields(rest))
+        if len(station) == 1 and rest.strip():
+            station['info'] = rest.strip()
+        stations.append(station)
+    return stations
+
+def parse_stainfo(text):
+    info = parse_fields(MAC_RE.sub('', text))
+    match = MAC_RE.search(text)
+    if match:
+        info['mac'] = match.group(0).lower()
+    return info
+
+PARSERS = {
+    'signal': parse_int,
+    'rssi': parse_int,
+    'bgrssi': parse_int,
+    'sta_count': parse_int,
+    'txpower': parse_int,
+    'bss_bw': parse_int,
+    'temperature': parse_number,
+    'battery_level': parse_number,
+    'freq_offset': parse_number,
+    'conn_state': parse_conn_state,
+    'scan_list': parse_scan_list,
+    'sta_list': parse_sta_list,
+    'stainfo': parse_stainfo,
+}
+
+def format_payload(data, fmt='hex'):
+    if fmt == 'hex':
+        return bytes(data).hex()
+    if fmt == 'base64':
+        return base64.b64encode(data).decode()
+    return str(data, errors='ignore').strip()
+
+def parse_payload(text, fmt='hex'):
+    # raises ValueError on malformed input
+    try:
+        if fmt == 'hex':
+            return bytes.fromhex(text)
+        if fmt == 'base64':
+            return base64.b64decode(text, validate=True)
+    except binascii.Error as e:
+        raise ValueError(str(e))
+    return text.encode()
+
+def parse_value(param, text):
+    if text is None:
+        return None
+    parser = PARSERS.get(param)
+    return parser(text) if parser else text.strip()
+
+# Library API, everything goes through the broker
+def iwpriv_text(ret, buff):
+    return str(buff, errors='ignore').strip() if ret > 0 else None
+
+def get_raw(param, ifname=IFNAME):
+    return iwpriv_text(*iwpriv_broker.call(f"{ifname} get {param}"))
+
+def get_bytes(param, ifname=IFNAME):
+    ret, buff = iwpriv_broker.call(f"{ifname} get {param}")
+    return buff if ret > 0 else None
+
+def get(param, ifname=IFNAME):
+    if param in BINARY_GETS:
+        return get_bytes(param, ifname)
+    return parse_value(param, get_raw(param, ifname))
+
+def get_many(params, ifname=IFNAME, raw=False):
+    # queue every get up front so the broker can run them back to back
+    pending = [(param, iwpriv_broker.submit(f"{ifname} get {param}")) for param in params]
+    values = {}
+    for param, request in pending:
+        text = iwpriv_text(*request.result) if request.done.wait(IWPRIV_TIMEOUT) else None
+        values[param] = text if raw else parse_value(param, text)
+    return values
+
+def set(param, value, ifname=IFNAME):
+    ret, _ = iwpriv_broker.call(f"{ifname} set {param}={value}")
+    return ret > 0
+
+def set_data(param, data, ifname=IFNAME):
+    # the payload goes to the driver byte for byte right after "set param="
+    ret, buff = iwpriv_broker.call(f"{ifname} set {param}=", data, len(data))
+    return ret, buff
 
 # Function translations
 def hgic_hw_state(state):
@@ -128,37 +483,57 @@ def hgic_hw_state(state):
     return states.get(state, "Unknown")
 
 def check_hgic_exists():
-    global HGIC
-    if os.path.exists("/proc/hgicf/iwpriv"):
-        HGIC = "hgicf"
-    elif os.path.exists("/proc/hgics/iwpriv"):
-        HGIC = "hgics"
-    else:
+    if get_device() is None:
         print("Neither /proc/hgicf/iwpriv nor /proc/hgics/iwpriv exists")
         return False
     return True
 
 # Main function
+def usage():
+    print("usage: hgpriv.py [--hex|--base64] ifname get param")
+    print("       hgpriv.py ifname set param=value")
+    print("       hgpriv.py ifname set param --data-hex HEX | --data-base64 B64 | --data-file FILE")
+
 def main(argv):
-    if len(argv) < 2:
+    fmt = None
+    payload = None
+    args = []
+    argv = list(argv[1:])
+    try:
+        while argv:
+            arg = argv.pop(0)
+            if arg in ("--hex", "--base64", "--text"):
+                fmt = arg[2:]
+            elif arg == "--data-hex":
+                payload = parse_payload(argv.pop(0), 'hex')
+            elif arg == "--data-base64":
+                payload = parse_payload(argv.pop(0), 'base64')
+            elif arg == "--data-file":
+                with open(argv.pop(0), 'rb') as f:
+                    payload = f.read()
+            else:
+                args.append(arg)
+    except (IndexError, ValueError, OSError) as e:
+        print(f"Bad arguments: {e}")
+        usage()
         return -1
-
-    if not check_hgic_exists():
+    if len(args) < 2:
+        usage()
         return -1
 
-    try:
-        buff = bytearray(4096)
-    except MemoryError:
-        print("no mem")
+    if not check_hgic_exists():
         return -1
 
-    cmd = ' '.join(argv[1:])
-    
-    buff[:] = b'\x00' * 4096
-    ret, buff = hgic_iwpriv_do(cmd, out_len=4096)
+    cmd = ' '.join(args)
+    if payload is not None:
+        cmd = cmd.rstrip('=') + '='
+        ret, buff = get_device().iwpriv(cmd, payload, len(payload), out_len=4096)
+    else:
+        ret, buff = get_device().iwpriv(cmd, out_len=4096)
+    if fmt is None:
+        fmt = 'hex' if len(args) > 2 and args[1] == 'get' and args[2] in BINARY_GETS else 'text'
     if ret > 0:
-        response = buff.decode(errors='ignore').strip()
-        print(f"RESP:{ret}\n{response}")
+        print(f"RESP:{ret}\n{format_payload(buff, fmt)}")
     else:
         print("No response received")
 
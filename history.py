@@ -0,0 +1,208 @@
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+
+# every ring file starts with: magic, version, record size, capacity, head slot, record count
+HEADER = struct.Struct('<4sHHIQQ')
+MAGIC = b'TXTS'
+VERSION = 1
+
+RAW_RECORD = struct.Struct('<dd')  # time, value
+ROLLUP_RECORD = struct.Struct('<dfffI')  # bucket start, min, avg, max, sample count
+
+RAW_CAPACITY = 86400  # one day of raw samples at one per second
+ROLLUPS = [
+    (10, 60480),  # 10 s buckets for a week
+    (60, 43200),  # 1 min buckets for a month
+    (3600, 8760),  # 1 h buckets for a year
+]
+MAX_POINTS = 1000  # default number of points returned by a query
+
+class RingFile:
+    def __init__(self, path, record, capacity):
+        self.record = record
+        self.capacity = capacity
+        size = HEADER.size + record.size * capacity
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size != size:
+                os.ftruncate(fd, size)
+            self.mm = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        magic, version, record_size, capacity, self.head, self.count = HEADER.unpack_from(self.mm, 0)
+        if (magic, version, record_size, capacity) != (MAGIC, VERSION, record.size, self.capacity):
+            self.head = 0
+            self.count = 0
+            self.write_header()
+
+    def reload(self):
+        # another process may be appending to the same file
+        self.head, self.count = HEADER.unpack_from(self.mm, 0)[4:]
+
+    def write_header(self):
+        HEADER.pack_into(self.mm, 0, MAGIC, VERSION, self.record.size, self.capacity, self.head, self.count)
+
+    def append(self, *values):
+        self.record.pack_into(self.mm, HEADER.size + self.head * self.record.size, *values)
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+        self.write_header()
+
+    def get(self, index):
+        # index 0 is the oldest record still in the ring
+        slot = (self.head - self.count + index) % self.capacity
+        return self.record.unpack_from(self.mm, HEADER.size + slot * self.record.size)
+
+    def last(self):
+        return self.get(self.count - 1) if self.count else None
+
+    def find(self, t):
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.get(mid)[0] < t:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def range(self, start, end):
+        for index in range(self.find(start), self.count):
+            record = self.get(index)
+            if record[0] >= end:
+                break
+            yield record
+
+    def close(self):
+        self.mm.flush()
+        self.mm.close()
+
+class Rollup:
+    def __init__(self, path, resolution, capacity):
+        self.resolution = resolution
+        self.ring = RingFile(path, ROLLUP_RECORD, capacity)
+        self.bucket = None
+
+    def add(self, t, value):
+        bucket = t - t % self.resolution
+        if self.bucket is not None and bucket != self.bucket[0]:
+            self.flush()
+        if self.bucket is None:
+            self.bucket = [bucket, value, 0.0, value, 0]
+        self.bucket[1] = min(self.bucket[1], value)
+        self.bucket[2] += value
+        self.bucket[3] = max(self.bucket[3], value)
+        self.bucket[4] += 1
+
+    def pending(self):
+        if self.bucket is None:
+            return None
+        start, low, total, high, count = self.bucket
+        return start, low, total / count, high, count
+
+    def flush(self):
+        if self.bucket is not None:
+            self.ring.append(*self.pending())
+            self.bucket = None
+
+    def range(self, start, end):
+        yield from self.ring.range(start, end)
+        record = self.pending()
+        if record and start <= record[0] < end:
+            yield record
+
+    def close(self):
+        self.flush()
+        self.ring.close()
+
+class Series:
+    def __init__(self, directory, metric):
+        self.raw = RingFile(os.path.join(directory, f"{metric}.raw"), RAW_RECORD, RAW_CAPACITY)
+        self.rollups = [Rollup(os.path.join(directory, f"{metric}.{resolution}s"), resolution, capacity)
+                        for resolution, capacity in ROLLUPS]
+        last = self.raw.last()
+        self.last_time = last[0] if last else 0
+
+    def add(self, t, value):
+        # the rings are searched by time, never let a clock step backwards reorder them
+        t = max(t, self.last_time)
+        self.last_time = t
+        self.raw.append(t, value)
+        for rollup in self.rollups:
+            rollup.add(t, value)
+
+    def query(self, start, end, step=None):
+        if not step:
+            step = max((end - start) / MAX_POINTS, 1)
+        self.raw.reload()
+        for rollup in self.rollups:
+            rollup.ring.reload()
+        resolution = 0
+        records = ((t, value, value, value, 1) for t, value in self.raw.range(start, end))
+        for rollup in self.rollups:
+            if rollup.resolution <= step:
+                resolution = rollup.resolution
+                records = rollup.range(start, end)
+
+        points = []
+        for t, low, avg, high, count in records:
+            bucket = start + (t - start) // step * step
+            if points and points[-1][0] == bucket:
+                point = points[-1]
+                point[1] = min(point[1], low)
+                point[2] += avg * count
+                point[3] = max(point[3], high)
+                point[4] += count
+            else:
+                points.append([bucket, low, avg * count, high, count])
+        return resolution, step, [[t, round(low, 2), round(total / count, 2), round(high, 2)]
+                                  for t, low, total, high, count in points]
+
+    def close(self):
+        self.raw.close()
+        for rollup in self.rollups:
+            rollup.close()
+
+class HistoryStore:
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.series = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def check_metric(self, metric):
+        if not re.fullmatch(r'\w+', metric):
+            raise ValueError(f"invalid metric name {metric!r}")
+
+    def get_series(self, metric):
+        self.check_metric(metric)
+        series = self.series.get(metric)
+        if series is None:
+            series = self.series[metric] = Series(self.directory, metric)
+        return series
+
+    def add(self, metric, value, t=None):
+        with self.lock:
+            self.get_series(metric).add(time.time() if t is None else t, float(value))
+
+    def query(self, metric, start, end, step=None):
+        self.check_metric(metric)
+        with self.lock:
+            if metric not in self.series and not os.path.exists(os.path.join(self.directory, f"{metric}.raw")):
+                return 0, step, []
+            return self.get_series(metric).query(start, end, step)
+
+    def metrics(self):
+        with self.lock:
+            names = {name.split('.', 1)[0] for name in os.listdir(self.directory) if name.endswith('.raw')}
+            return sorted(names | set(self.series))
+
+    def close(self):
+        with self.lock:
+            for series in self.series.values():
+                series.close()
+            self.series = {}
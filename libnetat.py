@@ -1,18 +1,68 @@
+import asyncio
 import socket
 import struct
 import random
 import time
 import sys
+import os
+import queue
+import threading
+from collections import deque
+
+try:
+    from tracing import span as trace_span, mark as trace_mark
+except ImportError:
+    import contextlib
+
+    def trace_span(name, **args):
+        return contextlib.nullcontext()
+
+    def trace_mark(name, **args):
+        pass
 
 NETAT_BUFF_SIZE = 4096  # Increase buffer size to handle longer commands
 NETAT_PORT = 56789
 NETLOG_PORT = 64320
+NETAT_TIMEOUT_MS = 1000  # overall deadline for one AT exchange
+NETAT_BATCH_WINDOW = 8  # AT commands kept in flight by send_batch
+NETAT_FLEET_WINDOW = 64
+NETAT_SCAN_TIMEOUT_MS = 2000
+NETAT_SCAN_QUIET_MS = 300  # scan ends once no new device answered for this long
 
 WNB_NETAT_CMD_SCAN_REQ = 1
 WNB_NETAT_CMD_SCAN_RESP = 2
 WNB_NETAT_CMD_AT_REQ = 3
 WNB_NETAT_CMD_AT_RESP = 4
 
+NETLOG_RING_SIZE = 2000  # log lines kept in memory per device
+NETLOG_SEGMENT_BYTES = 1024 * 1024  # on disk segment size before rotating
+NETLOG_SEGMENTS = 5  # rotated segments kept per device
+NETLOG_ANNOUNCE_INTERVAL = 30  # seconds, re-sent so rebooted modules log to us again
+NETLOG_SUBSCRIBER_SIZE = 256
+
+BROADCAST_MAC = b'\xff\xff\xff\xff\xff\xff'
+
+def netat_response_complete(response):
+    # the module ends every AT reply with an OK, ERROR or +ERR line
+    last = response.rstrip(b'\x00\r\n ').rsplit(b'\n', 1)[-1].strip()
+    return last == b'OK' or last == b'ERROR' or last.startswith(b'+ERR')
+
+def netat_response_ok(response):
+    if not response:
+        return False
+    last = response.rstrip('\x00\r\n ').rsplit('\n', 1)[-1].strip()
+    return last != 'ERROR' and not last.startswith('+ERR')
+
+def open_netat_socket(ifname, port):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+    if ifname:
+        sock.setsockopt(socket.SOL_SOCKET, 25, ifname.encode())
+
+    local_addr = ('', port)
+    sock.bind(local_addr)
+    return sock
+
 class WnbNetatCmd:
     def __init__(self, cmd, dest, src, data=b''):
         self.cmd = cmd
@@ -47,28 +97,35 @@ class WnbModuleNetlog:
         return cls(addr, cookie, ip, timestamp, port)
 
 class NetatMgr:
-    def __init__(self, ifname, port=NETAT_PORT):
+    def __init__(self, ifname, port=NETAT_PORT, target=None):
         self.sock = None
         self.dest = b'\xff\xff\xff\xff\xff\xff'
         self.cookie = self.random_bytes(6)
         self.recvbuf = bytearray(NETAT_BUFF_SIZE)
         self.port = port
+        # (host, port) to unicast to instead of broadcasting, e.g. the simulator in bench.py
+        self.target = target
         self.init_socket(ifname)
 
     def init_socket(self, ifname):
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-        self.sock.setsockopt(socket.SOL_SOCKET, 25, ifname.encode())
-
-        local_addr = ('', self.port)
-        self.sock.bind(local_addr)
+        self.sock = open_netat_socket(ifname, self.port)
 
     def random_bytes(self, length):
         return bytes([random.randint(0, 255) for _ in range(length)])
 
     def sock_send(self, data):
-        dest = ('<broadcast>', self.port)
-        self.sock.sendto(data, dest)
+        dest = self.target or ('<broadcast>', self.port)
+        with trace_span('udp_send', bytes=len(data)):
+            self.sock.sendto(data, dest)
+
+    def sock_flush(self):
+        # drop anything left over from an earlier exchange on a reused socket
+        self.sock.setblocking(False)
+        try:
+            while True:
+                self.sock.recvfrom(NETAT_BUFF_SIZE)
+        except OSError:
+            pass
 
     def sock_recv(self, timeout_ms):
         self.sock.settimeout(timeout_ms / 1000)
@@ -86,6 +143,40 @@ class NetatMgr:
         scan_cmd = WnbNetatCmd(WNB_NETAT_CMD_SCAN_REQ, b'\xff\xff\xff\xff\xff\xff', self.cookie)
         self.sock_send(scan_cmd.to_bytes())
 
+    def netat_scan_iter(self, timeout_ms=NETAT_SCAN_TIMEOUT_MS, quiet_ms=NETAT_SCAN_QUIET_MS, max_devices=None):
+        # yields each responding MAC once, as soon as its scan response arrives
+        self.netat_scan()
+        seen = set()
+        deadline = time.monotonic() + timeout_ms / 1000
+        quiet_deadline = None
+        while max_devices is None or len(seen) < max_devices:
+            end = deadline if quiet_deadline is None else min(deadline, quiet_deadline)
+            remaining_ms = (end - time.monotonic()) * 1000
+            if remaining_ms <= 0:
+                break
+            data = self.sock_recv(remaining_ms)
+            if data is None:
+                break
+            try:
+                cmd = WnbNetatCmd.from_bytes(data)
+            except Exception as e:
+                print(f"Error parsing data: {e}")
+                continue
+            if cmd.dest != self.cookie or cmd.cmd != WNB_NETAT_CMD_SCAN_RESP or cmd.src in seen:
+                continue
+            seen.add(cmd.src)
+            trace_mark('scan_response', device=format_mac_address(cmd.src))
+            quiet_deadline = time.monotonic() + quiet_ms / 1000
+            yield cmd.src
+
+    def netat_discover(self, callback=None, **kwargs):
+        devices = []
+        for device in self.netat_scan_iter(**kwargs):
+            devices.append(device)
+            if callback:
+                callback(device)
+        return devices
+
     def netlog_discover(self):
         self.cookie = self.random_bytes(6)
         ip = struct.unpack("!I", socket.inet_aton('255.255.255.255'))[0]
@@ -98,32 +189,128 @@ class NetatMgr:
         self.sock_send(cmd.to_bytes())
 
     def netat_recv(self, timeout_ms, expecting_response=False):
-        response = b""
-        devices = []
-        while True:
-            data = self.sock_recv(timeout_ms)
-            if data is None:
-                break
-
-            try:
-                cmd = WnbNetatCmd.from_bytes(data)
-                if cmd.dest == self.cookie:
-                    if cmd.cmd == WNB_NETAT_CMD_SCAN_RESP:
-                        devices.append(cmd.src)
-                    elif cmd.cmd == WNB_NETAT_CMD_AT_RESP:
-                        response += cmd.data
-                    if not expecting_response:
+        with trace_span('netat_recv', timeout_ms=timeout_ms):
+            response = b""
+            devices = []
+            deadline = time.monotonic() + timeout_ms / 1000
+            while True:
+                if expecting_response:
+                    remaining_ms = (deadline - time.monotonic()) * 1000
+                    if remaining_ms <= 0:
+                        trace_mark('netat_timeout')
                         break
-            except Exception as e:
-                print(f"Error parsing data: {e}")
+                    data = self.sock_recv(remaining_ms)
+                else:
+                    data = self.sock_recv(timeout_ms)
+                if data is None:
+                    if expecting_response:
+                        trace_mark('netat_timeout')
+                    break
 
-        if expecting_response:
-            if response:
-                return response.decode()
+                try:
+                    cmd = WnbNetatCmd.from_bytes(data)
+                    if cmd.dest == self.cookie:
+                        if cmd.cmd == WNB_NETAT_CMD_SCAN_RESP:
+                            devices.append(cmd.src)
+                        elif cmd.cmd == WNB_NETAT_CMD_AT_RESP:
+                            if not response:
+                                trace_mark('first_byte')
+                            response += cmd.data
+                            if expecting_response and netat_response_complete(response):
+                                trace_mark('terminator')
+                                break
+                        if not expecting_response:
+                            break
+                except Exception as e:
+                    print(f"Error parsing data: {e}")
+
+            if expecting_response:
+                if response:
+                    return response.decode()
+                else:
+                    print("No response from device or command not recognized.")
             else:
-                print("No response from device or command not recognized.")
-        else:
-            return devices
+                return devices
+
+    def send_batch(self, commands, window=NETAT_BATCH_WINDOW, timeout_ms=NETAT_TIMEOUT_MS):
+        # every command gets its own cookie as src so replies can be matched back by dest.
+        # a command can be a (dest_mac, atcmd) tuple to address a module other than self.dest
+        with trace_span('netat_batch', commands=len(commands), window=window):
+            results = [None] * len(commands)
+            pending = {}
+            next_idx = 0
+            timeout = timeout_ms / 1000
+            while next_idx < len(commands) or pending:
+                while next_idx < len(commands) and len(pending) < window:
+                    cookie = self.random_bytes(6)
+                    if cookie in pending:
+                        continue
+                    dest, atcmd = self.batch_target(commands[next_idx])
+                    cmd = WnbNetatCmd(WNB_NETAT_CMD_AT_REQ, dest, cookie, atcmd.encode())
+                    pending[cookie] = [next_idx, time.monotonic(), b""]
+                    self.sock_send(cmd.to_bytes())
+                    next_idx += 1
+
+                now = time.monotonic()
+                for cookie, (idx, start, response) in list(pending.items()):
+                    if now - start >= timeout:
+                        results[idx] = self.batch_result(commands[idx], response, start, now)
+                        del pending[cookie]
+                if not pending:
+                    continue
+
+                wait_ms = (min(entry[1] for entry in pending.values()) + timeout - now) * 1000
+                data = self.sock_recv(max(wait_ms, 1))
+                if data is None:
+                    continue
+                try:
+                    cmd = WnbNetatCmd.from_bytes(data)
+                except Exception as e:
+                    print(f"Error parsing data: {e}")
+                    continue
+                entry = pending.get(cmd.dest)
+                if entry is None or cmd.cmd != WNB_NETAT_CMD_AT_RESP:
+                    continue
+                if not entry[2]:
+                    trace_mark('first_byte', command=entry[0])
+                entry[2] += cmd.data
+                if netat_response_complete(entry[2]):
+                    trace_mark('terminator', command=entry[0])
+                    del pending[cmd.dest]
+                    results[entry[0]] = self.batch_result(commands[entry[0]], entry[2], entry[1], time.monotonic())
+            return results
+
+    def batch_target(self, command):
+        if isinstance(command, tuple):
+            return command
+        return self.dest, command
+
+    def batch_result(self, command, response, start, end):
+        return {
+            'command': self.batch_target(command)[1],
+            'response': response.decode(errors='ignore') if response else None,
+            'latency_ms': (end - start) * 1000,
+        }
+
+    def netat_fleet(self, commands, devices=None, window=NETAT_FLEET_WINDOW, timeout_ms=NETAT_TIMEOUT_MS):
+        start = time.monotonic()
+        if devices is None:
+            devices = self.netat_discover()
+        # command-major order so every device gets its first line before anyone gets a second
+        batch = [(device, command) for command in commands for device in devices]
+        results = self.send_batch(batch, window=window, timeout_ms=timeout_ms)
+        per_device = {device: [] for device in devices}
+        for (device, _), result in zip(batch, results):
+            per_device[device].append(result)
+        return {
+            'elapsed_ms': (time.monotonic() - start) * 1000,
+            'devices': [{
+                'device': format_mac_address(device),
+                'ok': all(netat_response_ok(result['response']) for result in device_results),
+                'latency_ms': max((result['latency_ms'] for result in device_results), default=0),
+                'results': device_results,
+            } for device, device_results in per_device.items()],
+        }
 
     def netlog_recv(self, timeout_ms):
         devices = []
@@ -139,6 +326,320 @@ class NetatMgr:
 
         return devices
 
+class NetatProtocol(asyncio.DatagramProtocol):
+    def __init__(self, handler):
+        self.handler = handler
+
+    def datagram_received(self, data, addr):
+        self.handler(data, addr)
+
+    def error_received(self, exc):
+        print(f"Error receiving data: {exc}")
+
+class AsyncNetatMgr:
+    def __init__(self, ifname, port=NETAT_PORT):
+        self.ifname = ifname
+        self.port = port
+        self.transport = None
+        self.netlog_transport = None
+        self.waiters = {}
+        self.netlog_listeners = []
+
+    async def open(self):
+        loop = asyncio.get_running_loop()
+        sock = open_netat_socket(self.ifname, self.port)
+        self.transport, _ = await loop.create_datagram_endpoint(lambda: NetatProtocol(self.netat_received), sock=sock)
+        return self
+
+    def close(self):
+        if self.transport:
+            self.transport.close()
+            self.transport = None
+        if self.netlog_transport:
+            self.netlog_transport.close()
+            self.netlog_transport = None
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, *exc):
+        self.close()
+
+    def new_cookie(self):
+        while True:
+            cookie = bytes(random.getrandbits(8) for _ in range(6))
+            if cookie not in self.waiters:
+                return cookie
+
+    def netat_received(self, data, addr):
+        try:
+            cmd = WnbNetatCmd.from_bytes(data)
+        except Exception as e:
+            print(f"Error parsing data: {e}")
+            return
+        waiter = self.waiters.get(cmd.dest)
+        if waiter:
+            waiter(cmd)
+
+    def netlog_received(self, data, addr):
+        try:
+            netlog = WnbModuleNetlog.from_bytes(data)
+        except Exception as e:
+            print(f"Error parsing netlog response: {e}")
+            return
+        if netlog.addr == BROADCAST_MAC:
+            return  # our own discover request
+        for queue in self.netlog_listeners:
+            queue.put_nowait(netlog.addr)
+
+    async def collect(self, queue, timeout_ms, quiet_ms, max_devices):
+        loop = asyncio.get_running_loop()
+        devices = []
+        deadline = loop.time() + timeout_ms / 1000
+        quiet_deadline = None
+        while max_devices is None or len(devices) < max_devices:
+            end = deadline if quiet_deadline is None else min(deadline, quiet_deadline)
+            remaining = end - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                device = await asyncio.wait_for(queue.get(), remaining)
+            except asyncio.TimeoutError:
+                break
+            if device not in devices:
+                devices.append(device)
+                quiet_deadline = loop.time() + quiet_ms / 1000
+        return devices
+
+    async def scan(self, timeout_ms=NETAT_SCAN_TIMEOUT_MS, quiet_ms=NETAT_SCAN_QUIET_MS, max_devices=None):
+        cookie = self.new_cookie()
+        queue = asyncio.Queue()
+
+        def on_reply(cmd):
+            if cmd.cmd == WNB_NETAT_CMD_SCAN_RESP:
+                queue.put_nowait(cmd.src)
+
+        self.waiters[cookie] = on_reply
+        try:
+            scan_cmd = WnbNetatCmd(WNB_NETAT_CMD_SCAN_REQ, BROADCAST_MAC, cookie)
+            self.transport.sendto(scan_cmd.to_bytes(), ('<broadcast>', self.port))
+            return await self.collect(queue, timeout_ms, quiet_ms, max_devices)
+        finally:
+            del self.waiters[cookie]
+
+    async def at(self, atcmd, dest, timeout_ms=NETAT_TIMEOUT_MS):
+        cookie = self.new_cookie()
+        future = asyncio.get_running_loop().create_future()
+        response = bytearray()
+
+        def on_reply(cmd):
+            if cmd.cmd != WNB_NETAT_CMD_AT_RESP or future.done():
+                return
+            response.extend(cmd.data)
+            if netat_response_complete(response):
+                future.set_result(None)
+
+        self.waiters[cookie] = on_reply
+        try:
+            cmd = WnbNetatCmd(WNB_NETAT_CMD_AT_REQ, dest, cookie, atcmd.encode())
+            self.transport.sendto(cmd.to_bytes(), ('<broadcast>', self.port))
+            await asyncio.wait_for(future, timeout_ms / 1000)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            del self.waiters[cookie]
+        return response.decode(errors='ignore') if response else None
+
+    async def netlog_discover(self, timeout_ms=NETAT_SCAN_TIMEOUT_MS, quiet_ms=NETAT_SCAN_QUIET_MS, max_devices=None):
+        if self.netlog_transport is None:
+            loop = asyncio.get_running_loop()
+            sock = open_netat_socket(self.ifname, NETLOG_PORT)
+            self.netlog_transport, _ = await loop.create_datagram_endpoint(lambda: NetatProtocol(self.netlog_received), sock=sock)
+        queue = asyncio.Queue()
+        self.netlog_listeners.append(queue)
+        try:
+            ip = struct.unpack("!I", socket.inet_aton('255.255.255.255'))[0]
+            netlog_pkt = WnbModuleNetlog(BROADCAST_MAC, self.new_cookie(), ip, int(time.time()), NETLOG_PORT)
+            self.netlog_transport.sendto(netlog_pkt.to_bytes(), ('<broadcast>', NETLOG_PORT))
+            return await self.collect(queue, timeout_ms, quiet_ms, max_devices)
+        finally:
+            self.netlog_listeners.remove(queue)
+
+class NetlogSegments:
+    # append only log file for one device, rotated like path, path.1 .. path.N
+    def __init__(self, path, max_bytes=NETLOG_SEGMENT_BYTES, count=NETLOG_SEGMENTS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.count = count
+        self.file = None
+
+    def write(self, text):
+        data = text.encode(errors='replace')
+        if self.file is None:
+            self.file = open(self.path, 'ab')
+        if self.file.tell() and self.file.tell() + len(data) > self.max_bytes:
+            self.rotate()
+        self.file.write(data)
+        self.file.flush()
+
+    def rotate(self):
+        self.file.close()
+        for i in range(self.count - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        os.replace(self.path, f"{self.path}.1")
+        self.file = open(self.path, 'ab')
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+class NetlogCollector:
+    # binds the netlog port once and keeps every module's log lines in a ring per device.
+    # devices are named by mac once they answered a netlog request, by ip until then
+    def __init__(self, ifname, port=NETLOG_PORT, directory=None, ring_size=NETLOG_RING_SIZE, target=None, on_entry=None):
+        self.sock = open_netat_socket(ifname, port)
+        self.port = port
+        self.target = target
+        self.on_entry = on_entry  # called with every new entry from the receive thread
+        self.directory = directory
+        self.ring_size = ring_size
+        self.cookie = bytes(random.randint(0, 255) for _ in range(6))
+        self.lock = threading.Lock()
+        self.rings = {}
+        self.segments = {}
+        self.names = {}
+        self.seq = 0
+        self.subscribers = []
+        self.thread = None
+        self.running = False
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def start(self):
+        if self.thread is None:
+            self.running = True
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def announce(self):
+        ip = struct.unpack("!I", socket.inet_aton('255.255.255.255'))[0]
+        netlog_pkt = WnbModuleNetlog(BROADCAST_MAC, self.cookie, ip, int(time.time()), self.port)
+        try:
+            self.sock.sendto(netlog_pkt.to_bytes(), self.target or ('<broadcast>', self.port))
+        except OSError as e:
+            print(f"Netlog announce failed: {e}")
+
+    def run(self):
+        self.sock.settimeout(1)
+        announced = 0
+        while self.running:
+            if time.monotonic() - announced > NETLOG_ANNOUNCE_INTERVAL:
+                self.announce()
+                announced = time.monotonic()
+            try:
+                data, addr = self.sock.recvfrom(NETAT_BUFF_SIZE)
+            except socket.timeout:
+                continue
+            except OSError:
+                if self.running:
+                    print("Netlog socket closed")
+                break
+            self.received(data, addr)
+
+    def received(self, data, addr):
+        if len(data) == 23:
+            netlog = WnbModuleNetlog.from_bytes(data)
+            if netlog.cookie == self.cookie or netlog.port == self.port or netlog.addr == BROADCAST_MAC:
+                # our own broadcast or a module answering it
+                if netlog.addr != BROADCAST_MAC:
+                    self.names[addr[0]] = format_mac_address(netlog.addr)
+                return
+        device = self.names.get(addr[0], addr[0])
+        text = data.decode(errors='replace').replace('\x00', '')
+        for line in text.splitlines():
+            if line.strip():
+                self.add(device, line.rstrip())
+
+    def add(self, device, text):
+        with self.lock:
+            self.seq += 1
+            entry = {'seq': self.seq, 'time': time.time(), 'device': device, 'text': text}
+            ring = self.rings.get(device)
+            if ring is None:
+                ring = self.rings[device] = deque(maxlen=self.ring_size)
+            ring.append(entry)
+            subscribers = [subscriber for subscriber, wanted in self.subscribers if wanted in (None, device)]
+        if self.directory:
+            self.write_segment(device, entry)
+        if self.on_entry is not None:
+            self.on_entry(entry)
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(entry)
+            except queue.Full:
+                pass
+        return entry
+
+    def write_segment(self, device, entry):
+        segments = self.segments.get(device)
+        if segments is None:
+            name = device.replace(':', '')
+            segments = self.segments[device] = NetlogSegments(os.path.join(self.directory, f"{name}.log"))
+        stamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry['time']))
+        try:
+            segments.write(f"{stamp} {entry['text']}\n")
+        except OSError as e:
+            print(f"Netlog write failed for {device}: {e}")
+
+    def restore(self, entries):
+        # continue where an earlier collector left off, sequence numbers keep counting up
+        with self.lock:
+            for entry in entries:
+                ring = self.rings.get(entry['device'])
+                if ring is None:
+                    ring = self.rings[entry['device']] = deque(maxlen=self.ring_size)
+                ring.append(entry)
+                self.seq = max(self.seq, entry['seq'])
+
+    def collect(self, device, since):
+        # caller holds the lock
+        if device is None:
+            rings = list(self.rings.values())
+        else:
+            rings = [self.rings[device]] if device in self.rings else []
+        entries = [entry for ring in rings for entry in ring if entry['seq'] > since]
+        entries.sort(key=lambda entry: entry['seq'])
+        return entries
+
+    def entries(self, device=None, since=0, limit=None):
+        with self.lock:
+            entries = self.collect(device, since)
+        return entries[-limit:] if limit else entries
+
+    def devices(self):
+        with self.lock:
+            return {device: len(ring) for device, ring in self.rings.items()}
+
+    def subscribe(self, device=None, since=None):
+        # the backlog after since is taken under the same lock, so nothing falls in between
+        subscriber = queue.Queue(maxsize=NETLOG_SUBSCRIBER_SIZE)
+        with self.lock:
+            backlog = self.collect(device, since) if since is not None else []
+            self.subscribers.append((subscriber, device))
+        return subscriber, backlog
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers = [item for item in self.subscribers if item[0] is not subscriber]
+
+    def close(self):
+        self.running = False
+        self.sock.close()
+        for segments in self.segments.values():
+            segments.close()
+
 def select_device(devices):
     if len(devices) == 1:
         return devices[0]
@@ -159,6 +660,9 @@ def parse_mac_address(mac_str):
         print("Invalid MAC address format")
         sys.exit(1)
 
+def format_mac_address(mac):
+    return ':'.join(f'{b:02x}' for b in mac)
+
 def load_config_from_file(file_path):
     config_commands = []
     try:
@@ -173,6 +677,38 @@ def load_config_from_file(file_path):
         sys.exit(1)
     return config_commands
 
+def apply_config(mgr, config_commands):
+    commands = [f"AT+{cmd}={value}" for cmd, value in config_commands]
+    results = mgr.send_batch(commands)
+    for (cmd, value), result in zip(config_commands, results):
+        print(f"Sent: {cmd} = {value} ({result['latency_ms']:.1f} ms)")  # Display parameter and value
+        if result['response']:
+            print(result['response'])
+        else:
+            print(f"Command {result['command']} failed or no response received.")
+
+def fleet(ifname, target, dest_macs=None):
+    if not target:
+        print("fleet needs an AT command or a config file")
+        return
+    mgr = NetatMgr(ifname)
+    if os.path.isfile(target):
+        commands = [f"AT+{cmd}={value}" for cmd, value in load_config_from_file(target)]
+    else:
+        commands = [target]
+    devices = [parse_mac_address(mac) for mac in dest_macs.split(',')] if dest_macs else None
+    report = mgr.netat_fleet(commands, devices)
+    if not report['devices']:
+        print("No devices found.")
+        return
+    for entry in report['devices']:
+        print(f"{entry['device']}  {'OK' if entry['ok'] else 'FAIL':4}  {entry['latency_ms']:8.1f} ms")
+        for result in entry['results']:
+            response = (result['response'] or 'no response').strip().replace('\r', '').replace('\n', ' | ')
+            print(f"    {result['command']}: {response}")
+    failed = sum(1 for entry in report['devices'] if not entry['ok'])
+    print(f"{len(report['devices'])} devices, {failed} failed, {report['elapsed_ms']:.1f} ms")
+
 def netlog(ifname):
     mgr = NetatMgr(ifname, port=NETLOG_PORT)
     mgr.netlog_discover()
@@ -185,7 +721,7 @@ def netlog(ifname):
 
         # Send 02 command
         mgr.netat_send("02")
-        response = mgr.netat_recv(1000, expecting_response=True)
+        response = mgr.netat_recv(NETAT_TIMEOUT_MS, expecting_response=True)
         if response:
             print(response)
         else:
@@ -193,7 +729,30 @@ def netlog(ifname):
     else:
         print("No devices found.")
 
+def netlog_tail(ifname, directory=None):
+    collector = NetlogCollector(ifname, directory=directory)
+    subscriber, _ = collector.subscribe()
+    collector.start()
+    try:
+        while True:
+            entry = subscriber.get()
+            print(f"{entry['device']}: {entry['text']}", flush=True)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        collector.close()
+
 def main(ifname, command=None, dest_mac=None, config_file=None):
+    if command == "netlog" and dest_mac == "tail":
+        # netlog tail [log_dir]
+        netlog_tail(ifname, config_file)
+        return
+
+    if command == "fleet":
+        # fleet <at command or config file> [mac,mac,...]
+        fleet(ifname, dest_mac, config_file)
+        return
+
     mgr = NetatMgr(ifname)
 
     if command == "netlog":
@@ -201,13 +760,8 @@ def main(ifname, command=None, dest_mac=None, config_file=None):
         return
 
     if command == "scan":
-        mgr.netat_scan()
-        time.sleep(2)  # Wait for responses
-        devices = mgr.netat_recv(2000)
-        if devices:
-            for device in devices:
-                print(':'.join(f'{b:02x}' for b in device))
-        else:
+        devices = mgr.netat_discover(callback=lambda device: print(format_mac_address(device), flush=True))
+        if not devices:
             print("No devices found.")
         return
 
@@ -215,33 +769,21 @@ def main(ifname, command=None, dest_mac=None, config_file=None):
         mgr.dest = parse_mac_address(dest_mac)
     else:
         while True:
-            mgr.netat_scan()
-            time.sleep(1)  # wait for the scan to complete
-            devices = mgr.netat_recv(1000)
+            devices = mgr.netat_discover()
 
             if devices:
                 mgr.dest = select_device(devices)
                 break
             else:
                 print("No devices found. Retrying...")
-                time.sleep(1)
 
     if config_file:
-        config_commands = load_config_from_file(config_file)
-        for cmd, value in config_commands:
-            full_command = f"AT+{cmd}={value}"
-            print(f"Sending: {cmd} = {value}")  # Display parameter and value
-            mgr.netat_send(full_command)
-            response = mgr.netat_recv(1000, expecting_response=True)
-            if response:
-                print(response)
-            else:
-                print(f"Command {full_command} failed or no response received.")
+        apply_config(mgr, load_config_from_file(config_file))
         return
 
     if command:
         mgr.netat_send(command)
-        response = mgr.netat_recv(1000, expecting_response=True)
+        response = mgr.netat_recv(NETAT_TIMEOUT_MS, expecting_response=True)
         if response:
             print(response)
         else:
@@ -253,12 +795,8 @@ def main(ifname, command=None, dest_mac=None, config_file=None):
                 if input_cmd == "exit":
                     break
                 elif input_cmd == "scan":
-                    mgr.netat_scan()
-                    time.sleep(1)
-                    devices = mgr.netat_recv(1000)
+                    devices = mgr.netat_discover(callback=lambda device: print(format_mac_address(device)))
                     if devices:
-                        for device in devices:
-                            print(':'.join(f'{b:02x}' for b in device))
                         mgr.dest = select_device(devices)
                     else:
                         print("No devices found.")
@@ -266,7 +804,7 @@ def main(ifname, command=None, dest_mac=None, config_file=None):
                     print(f"Current destination MAC address: {':'.join(f'{b:02x}' for b in mgr.dest)}")
                 elif input_cmd.startswith("at"):
                     mgr.netat_send(input_cmd)
-                    response = mgr.netat_recv(1000, expecting_response=True)
+                    response = mgr.netat_recv(NETAT_TIMEOUT_MS, expecting_response=True)
                     if response:
                         print(response)
                     else:
@@ -277,22 +815,15 @@ def main(ifname, command=None, dest_mac=None, config_file=None):
                     print(f"Destination MAC address set to {':'.join(f'{b:02x}' for b in mgr.dest)}")
                 elif input_cmd.startswith("loadconfig"):
                     _, file_path = input_cmd.split()
-                    config_commands = load_config_from_file(file_path)
-                    for cmd, value in config_commands:
-                        full_command = f"AT+{cmd}={value}"
-                        print(f"Sending: {cmd} = {value}")  # Display parameter and value
-                        mgr.netat_send(full_command)
-                        response = mgr.netat_recv(1000, expecting_response=True)
-                        if response:
-                            print(response)
-                        else:
-                            print(f"Command {full_command} failed or no response received.")
+                    apply_config(mgr, load_config_from_file(file_path))
             except KeyboardInterrupt:
                 break
 
 if __name__ == "__main__":
     if len(sys.argv) < 2:
         print("Usage: {} <interface> [command] [dest_mac] [config_file]".format(sys.argv[0]))
+        print("       {} <interface> fleet <command|config_file> [mac,mac,...]".format(sys.argv[0]))
+        print("       {} <interface> netlog tail [log_dir]".format(sys.argv[0]))
     else:
         ifname = sys.argv[1]
         command = sys.argv[2] if len(sys.argv) > 2 else None
@@ -1,10 +1,41 @@
-from flask import Flask, request, jsonify, render_template_string, redirect, url_for
+from flask import Flask, Response, request, jsonify, render_template_string, redirect, url_for
 from werkzeug.utils import secure_filename
+from werkzeug.sansio.multipart import MultipartDecoder, NEED_DATA, File, Data, Epilogue
 import subprocess
 import re
 import os
 import json
+import sys
 import time
+import argparse
+import contextlib
+import threading
+import socket
+import errno
+import struct
+import fcntl
+import queue
+import secrets
+import hashlib
+import zlib
+import array
+import bisect
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import hgpriv
+except ImportError:
+    hgpriv = None
+
+try:
+    import libnetat
+except ImportError:
+    libnetat = None
+
+import history
+import tracing
+from tracing import span as trace_span
 
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = '/tmp/'
@@ -42,6 +73,83 @@ DEFAULT_SETTINGS_FILE = os.path.join(CONFIG_DIR, 'hgicf-template.conf')
 WIFI_SSID_FILE = '/boot/wifi.ssid'
 WIFI_PASS_FILE = '/boot/wifi.pass'
 
+IFNAME = 'hg0'
+HGPRIV_BIN = '/sbin/hgpriv'
+LIBNETAT_BIN = '/sbin/libnetat'
+MAC_RE = re.compile(r'(?:[0-9a-fA-F]{2}:){5}[0-9a-fA-F]{2}')
+NETAT_TIMEOUT_MS = 1000
+NETAT_SESSIONS = {}
+NETAT_SESSIONS_LOCK = threading.Lock()
+
+STATUS_PARAMS = ['ssid', 'bssid', 'txpower', 'bss_bw', 'conn_state']
+STATUS_TTL = 5  # seconds a status snapshot is served before it is sampled again
+LINK_SAMPLE_INTERVAL = 2  # seconds between signal/conn_state samples pushed to /stream
+SUBSCRIBER_QUEUE_SIZE = 32
+TELEMETRY_PARAMS = ['temperature', 'battery_level', 'freq_offset']
+TELEMETRY_INTERVAL = 30
+STATION_INTERVAL = 5  # seconds between sta_count/sta_list/stainfo polls in ap mode
+STATION_SLOTS = 256  # stations tracked at once, the least recently seen is evicted beyond that
+STATION_HISTORY = 32  # samples kept per station for the rolling rssi/rate figures
+STATION_MAX_AGE = 300  # a station not seen for this long frees its slot
+STATION_RSSI_KEYS = ['rssi', 'signal']
+STATION_RATE_KEYS = ['rate', 'tx_rate', 'txrate', 'mcs']
+HISTORY_DIR = '/var/lib/taixin_tools/history'
+SURVEY_HWSCAN_ARGS = '1'  # value passed to set hwscan to start a hardware scan
+SURVEY_SCAN_WAIT = 2  # seconds before the first scan_list read
+SURVEY_POLL_INTERVAL = 0.5
+SURVEY_POLL_TIMEOUT = 6  # give up waiting for scan_list to settle after this long
+SURVEY_MIN_INTERVAL = 2  # callers arriving sooner than this share the previous scan
+SURVEY_MAX_AGE = 600  # a bss not seen for this long is dropped from the table
+SURVEY_TOMBSTONES = 256  # removed bssids remembered for deltas
+SURVEY_SEEN_BUCKET = 30  # an unchanged bss is resent this often so its last_seen does not go stale
+SURVEY_FIELDS = ['bssid', 'ssid', 'encryption', 'frequency', 'signal', 'rssi_min', 'rssi_avg', 'rssi_max',
+                 'first_seen', 'last_seen', 'seen']
+METRIC_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5]  # seconds
+SPAWN_PROGRAMS = ['hgpriv', 'libnetat', 'ifconfig', 'route', 'reboot']  # anything else is counted as other
+METRIC_HELP = {
+    'taixin_signal_dbm': ('gauge', 'Last sampled signal'),
+    'taixin_conn_state': ('gauge', 'Connection state, 1 for the current state'),
+    'taixin_temperature': ('gauge', 'Module temperature'),
+    'taixin_battery_level': ('gauge', 'Battery level'),
+    'taixin_freq_offset': ('gauge', 'Crystal frequency offset'),
+    'taixin_sta_count': ('gauge', 'Associated stations'),
+    'taixin_sample_age_seconds': ('gauge', 'Age of the cached sample each value came from'),
+    'taixin_command_duration_seconds': ('histogram', 'Radio command latency by backend and param'),
+    'taixin_command_errors_total': ('counter', 'Radio commands that failed'),
+    'taixin_sampler_refresh_seconds': ('histogram', 'Time taken by one sampler refresh'),
+    'taixin_subprocess_spawns_total': ('counter', 'Processes started by the server'),
+    'taixin_netat_timeouts_total': ('counter', 'netat requests that got no reply'),
+    'taixin_iwpriv_calls_total': ('counter', 'Driver calls made by the iwpriv broker'),
+    'taixin_iwpriv_coalesced_total': ('counter', 'Gets answered by an identical in-flight driver call'),
+    'taixin_iwpriv_errors_total': ('counter', 'Driver calls that failed'),
+    'taixin_iwpriv_timeouts_total': ('counter', 'Broker callers that gave up waiting'),
+}
+NETLOG_DIR = '/var/lib/taixin_tools/netlog'
+NETLOG_LIMIT = 500  # default number of lines returned by /netlog
+NETLOG_JOURNAL = 'netlog.jsonl'  # in SHARED_STATE_DIR, how the collecting worker hands lines to the others
+NETLOG_JOURNAL_BYTES = 4 * 1024 * 1024  # rotated to .1 beyond this
+NETLOG_JOURNAL_ENTRIES = 20000  # lines a reading worker keeps in memory
+NETLOG_QUEUE_SIZE = 256
+# state shared between worker processes when running under --production with several workers
+SHARED_STATE_DIR = '/tmp/taixin_tools'
+JOB_SAVE_INTERVAL = 0.5
+METRICS_SHARE_INTERVAL = 5  # seconds between a worker's counter snapshots, what a scrape of another worker lags by
+SHARED_POLL_INTERVAL = 0.1  # how often the leader looks for invalidations from other workers
+FOLLOWER_WAIT = 3  # seconds a follower waits for the leader's next snapshot
+SSE_KEEPALIVE = 15
+BATCH_MAX_OPS = 64
+BATCH_WORKERS = 4  # concurrent subprocess reads when a batch falls back to the binaries
+OUTPUT_FORMATS = ['text', 'hex', 'base64']
+NO_RESPONSE = ("No response received", "No response from device")
+HGIC_MISSING = "hgic driver not loaded"
+PAIRING_TIMEOUT = 20
+PAIRING_POLL_INTERVAL = 1
+CONN_STATE_CONNECTED = 9
+OTA_REBOOT_DELAY = 30
+OTA_CHUNK_SIZE = 64 * 1024
+WORKERS = 1  # set by serve_production, inherited by the forked workers
+JOB_HISTORY = 20  # finished jobs kept around for /jobs
+
 MODE_FILE = os.path.join(CONFIG_DIR, 'mode.conf')
 MODES = ['hgpriv', 'libnetat']
 DEFAULT_MODE = 'hgpriv'
@@ -51,6 +159,13 @@ COMMAND_REMAP = {
     'signal': 'rssi'
 }
 
+# apply_settings writes these first, in this order: they make the firmware rescan or
+# reassociate, so everything after them is applied to the final channel/bss
+SETTINGS_ORDER = [
+    'country_region', 'mode', 'freq_range', 'chan_list', 'bss_bw', 'tx_bw', 'primary_chan',
+    'ssid', 'key_mgmt', 'wpa_psk', 'r_ssid', 'r_psk'
+]
+
 HTML_TEMPLATE = """
 <!DOCTYPE html>
 <html>
@@ -125,15 +240,20 @@ HTML_TEMPLATE = """
                         <label for="value">Value (for Set commands only):</label>
                         <input type="text" class="form-control" id="value" name="value">
                     </div>
-                    <div class="form-group" id="intervalGroup" style="display: none;">
-                        <label for="interval">Refresh Interval (seconds):</label>
-                        <input type="number" class="form-control" id="interval" name="interval" value="5" min="1">
-                    </div>
                     <button type="button" class="btn btn-primary" onclick="sendCommand()">Send</button>
                 </form>
                 <h2>Response:</h2>
                 <pre id="response" class="bg-light p-3 border rounded"></pre>
                 <canvas id="signalChart" width="400" height="200" class="my-4"></canvas>
+                <div class="form-group" id="signalRangeGroup" style="display: none;">
+                    <label for="signalRange">Signal History:</label>
+                    <select class="form-control" id="signalRange" name="signalRange" onchange="changeSignalRange()">
+                        <option value="live">Live</option>
+                        <option value="3600">Last hour</option>
+                        <option value="86400">Last day</option>
+                        <option value="604800">Last week</option>
+                    </select>
+                </div>
             </div>
             <div class="tab-pane fade" id="station-settings">
                 <h2>Station Settings</h2>
@@ -236,13 +356,14 @@ HTML_TEMPLATE = """
                 <h3>Command Output:</h3>
                 <pre id="commandOutput" class="bg-light p-3 border rounded"></pre>
                 <h3>Firmware Upload</h3>
-                <form action="/upload_firmware" method="post" enctype="multipart/form-data">
+                <form id="firmwareForm" onsubmit="uploadFirmware(); return false;">
                     <div class="form-group">
                         <label for="firmware">Choose firmware file:</label>
                         <input type="file" class="form-control" id="firmware" name="firmware">
                     </div>
                     <button type="submit" class="btn btn-primary">Upload</button>
                 </form>
+                <pre id="firmwareStatus" class="bg-light p-3 border rounded"></pre>
                 <h3>Mode Setting</h3>
                 <form id="modeSettingForm">
                     <div class="form-group">
@@ -271,6 +392,10 @@ HTML_TEMPLATE = """
             <div class="tab-pane fade" id="site-survey">
                 <h2>Site Survey</h2>
                 <button type="button" class="btn btn-primary" onclick="runSiteSurvey()">Run Site Survey</button>
+                <div class="form-check form-check-inline ml-3">
+                    <input class="form-check-input" type="checkbox" id="surveyRepeat" onchange="if (this.checked) runSiteSurvey()">
+                    <label class="form-check-label" for="surveyRepeat">Keep scanning</label>
+                </div>
                 <h3>Survey Results</h3>
                 <table class="table table-bordered">
                     <thead>
@@ -280,6 +405,8 @@ HTML_TEMPLATE = """
                             <th>Encryption</th>
                             <th>Frequency</th>
                             <th>Signal</th>
+                            <th>Min / Avg / Max</th>
+                            <th>Last Seen</th>
                         </tr>
                     </thead>
                     <tbody id="surveyResults">
@@ -291,10 +418,10 @@ HTML_TEMPLATE = """
     <script>
         const setCommands = {{ set_commands | tojson }};
         const getCommands = {{ get_commands | tojson }};
-        let rssiInterval;
         let signalChart;
         let signalData = [];
-        let connStateInterval;
+        let linkStream;
+        const signalPoints = 150;
 
         function updateCommands() {
             const commandType = document.getElementById('commandType').value;
@@ -310,15 +437,21 @@ HTML_TEMPLATE = """
             document.getElementById('valueGroup').style.display = commandType === 'set' ? 'block' : 'none';
         }
 
-        function checkSignal() {
+        function isSignalCommand() {
             const command = document.getElementById('command').value;
-            const intervalGroup = document.getElementById('intervalGroup');
-            if (command === 'signal' || command === 'rssi') {
-                intervalGroup.style.display = 'block';
-                setupChart();
+            return command === 'signal' || command === 'rssi';
+        }
+
+        function checkSignal() {
+            const signalRangeGroup = document.getElementById('signalRangeGroup');
+            if (isSignalCommand()) {
+                signalRangeGroup.style.display = 'block';
+                if (!signalChart) {
+                    setupChart();
+                    changeSignalRange();
+                }
             } else {
-                intervalGroup.style.display = 'none';
-                clearInterval(rssiInterval);
+                signalRangeGroup.style.display = 'none';
                 if (signalChart) {
                     signalChart.destroy();
                     signalChart = null;
@@ -330,44 +463,79 @@ HTML_TEMPLATE = """
             const commandType = document.getElementById('commandType').value;
             const command = document.getElementById('command').value;
             const value = document.getElementById('value').value;
-            const interval = document.getElementById('interval').value;
             const url = `/command?cmd=${commandType}&param=${encodeURIComponent(command)}${commandType === 'set' ? '&value=' + encodeURIComponent(value) : ''}`;
-            
-            if (command === 'signal' || command === 'rssi') {
-                clearInterval(rssiInterval);
-                fetchAndUpdateSignal(url);
-                rssiInterval = setInterval(() => fetchAndUpdateSignal(url), interval * 1000);
-            } else {
-                fetch(url)
-                    .then(response => response.json())
-                    .then(data => {
-                        const responseText = data.response.replace(/^RESP:\\d+\\s*/, '');
-                        document.getElementById('response').innerText = responseText;
-                    });
-            }
-        }
 
-        function fetchAndUpdateSignal(url) {
+            if (commandType === 'get' && isSignalCommand()) {
+                // signal is pushed by the server over /stream, just make sure we are listening
+                startLinkStream();
+                return;
+            }
             fetch(url)
                 .then(response => response.json())
                 .then(data => {
-                    const responseText = data.response.replace(/^RESP:\\d+\\s*/, '').trim();
+                    const responseText = data.response.replace(/^RESP:\\d+\\s*/, '');
                     document.getElementById('response').innerText = responseText;
-                    const matches = responseText.match(/-?\\d+/);
-                    if (matches) {
-                        const rssi = parseInt(matches[0]);
-                        const now = new Date();
-                        signalData.push({x: now, y: rssi});
-                        if (signalData.length > 20) {
-                            signalData.shift();
-                        }
-                        if (signalChart) {
-                            signalChart.update();
-                        }
-                    }
                 });
         }
 
+        function fetchHistory(metric, seconds, points) {
+            const to = Date.now() / 1000;
+            return fetch(`/history?metric=${metric}&from=${to - seconds}&to=${to}&step=${Math.max(seconds / points, 1)}`)
+                .then(response => response.json())
+                .then(data => data.status === 'success' ? data.points.map(p => ({x: new Date(p[0] * 1000), y: p[2]})) : []);
+        }
+
+        function changeSignalRange() {
+            const range = document.getElementById('signalRange').value;
+            if (!signalChart) {
+                return;
+            }
+            if (range === 'live') {
+                signalChart.data.datasets[0].data = signalData;
+                signalChart.options.scales.x.time.unit = 'second';
+                signalChart.update();
+                return;
+            }
+            fetchHistory('signal', parseInt(range), 300).then(points => {
+                signalChart.data.datasets[0].data = points;
+                signalChart.options.scales.x.time.unit = false;
+                signalChart.update();
+            });
+        }
+
+        function startLinkStream() {
+            if (linkStream) {
+                return;
+            }
+            // seed the live chart with the last few minutes the server already recorded
+            fetchHistory('signal', signalPoints * 2, signalPoints).then(points => {
+                if (signalData.length === 0) {
+                    signalData.push(...points);
+                    if (signalChart) {
+                        signalChart.update();
+                    }
+                }
+            });
+            linkStream = new EventSource('/stream');
+            linkStream.onmessage = event => {
+                const sample = JSON.parse(event.data);
+                updateConnState(sample.conn_state, sample.conn_state_raw);
+                if (sample.signal === null) {
+                    return;
+                }
+                if (isSignalCommand()) {
+                    document.getElementById('response').innerText = sample.signal_raw;
+                }
+                signalData.push({x: new Date(sample.time * 1000), y: sample.signal});
+                if (signalData.length > signalPoints) {
+                    signalData.shift();
+                }
+                if (signalChart) {
+                    signalChart.update();
+                }
+            };
+        }
+
         function setupChart() {
             const ctx = document.getElementById('signalChart').getContext('2d');
             signalChart = new Chart(ctx, {
@@ -517,24 +685,82 @@ HTML_TEMPLATE = """
             });
         }
 
+        function waitForJob(jobId, onProgress) {
+            return new Promise(resolve => {
+                const poll = () => fetch(`/jobs/${jobId}`)
+                    .then(response => response.json())
+                    .then(data => {
+                        onProgress(data.job);
+                        if (data.job.status === 'running') {
+                            setTimeout(poll, 1000);
+                        } else {
+                            resolve(data.job);
+                        }
+                    });
+                poll();
+            });
+        }
+
+        function uploadFirmware() {
+            const file = document.getElementById('firmware').files[0];
+            const firmwareStatus = document.getElementById('firmwareStatus');
+            if (!file) {
+                return;
+            }
+            const xhr = new XMLHttpRequest();
+            xhr.open('POST', `/upload_firmware?filename=${encodeURIComponent(file.name)}`);
+            xhr.setRequestHeader('Content-Type', 'application/octet-stream');
+            xhr.upload.onprogress = event => {
+                if (event.lengthComputable) {
+                    firmwareStatus.innerText = `Uploading... ${Math.round(event.loaded / event.total * 100)}%`;
+                }
+            };
+            xhr.onload = () => {
+                const data = JSON.parse(xhr.responseText);
+                if (data.status !== 'success') {
+                    firmwareStatus.innerText = `Firmware upload failed: ${data.error || ''}`;
+                    return;
+                }
+                const ota = data.ota;
+                firmwareStatus.innerText = `Wrote ${ota.bytes} bytes at ${Math.round(ota.bytes_per_second / 1024)} KiB/s, sha256 ${ota.sha256}`;
+                waitForJob(data.job, job => {
+                    firmwareStatus.innerText = `${job.message} ${Math.round(job.progress)}%\\nsha256 ${ota.sha256}`;
+                }).then(job => {
+                    firmwareStatus.innerText = job.status === 'success' ? `Firmware written (sha256 ${ota.sha256}), system is rebooting.` : `Firmware upload failed: ${job.message}`;
+                });
+            };
+            xhr.onerror = () => {
+                firmwareStatus.innerText = 'Firmware upload failed.';
+            };
+            xhr.send(file);
+        }
+
         function quickPair() {
+            const pairingDetails = document.getElementById('pairingDetails');
             fetch('/quick_pair', { method: 'POST' })
                 .then(response => response.json())
                 .then(data => {
-                    if (data.status === 'success') {
-                        fetch('/command?cmd=get&param=ssid')
-                            .then(response => response.json())
-                            .then(ssidData => {
-                                const ssid = ssidData.response.replace(/^RESP:\\d+\\s*/, '').trim();
-                                fetch('/command?cmd=get&param=wpa_psk')
-                                    .then(response => response.json())
-                                    .then(wpaPskData => {
-                                        const wpa_psk = wpaPskData.response.replace(/^RESP:\\d+\\s*/, '').trim();
-                                        document.getElementById('pairingDetails').innerText = `SSID: ${ssid}\\nWPA PSK: ${wpa_psk}`;
-                                    });
-                            });
-                    } else {
+                    if (data.status !== 'success') {
                         alert('Failed to start pairing.');
+                        return;
+                    }
+                    return waitForJob(data.job, job => {
+                        pairingDetails.innerText = `Pairing... ${Math.round(job.progress)}% ${job.message}`;
+                    });
+                })
+                .then(job => {
+                    if (job) {
+                        fetch('/command/batch', {
+                            method: 'POST',
+                            headers: {
+                                'Content-Type': 'application/json'
+                            },
+                            body: JSON.stringify({ ops: [{cmd: 'get', param: 'ssid'}, {cmd: 'get', param: 'wpa_psk'}] })
+                        }).then(response => response.json())
+                        .then(batch => {
+                            const [ssid, wpa_psk] = batch.results.map(r => (r.response || '').replace(/^RESP:\\d+\\s*/, '').trim());
+                            pairingDetails.innerText = `SSID: ${ssid}\\nWPA PSK: ${wpa_psk}`;
+                        });
                     }
                 });
         }
@@ -569,59 +795,54 @@ HTML_TEMPLATE = """
             });
         }
 
-        function updateConnState() {
-            fetch('/command?cmd=get&param=conn_state')
-                .then(response => response.json())
-                .then(data => {
-                    const connState = parseInt(data.response.replace(/^RESP:\\d+\\s*/, '').trim());
-                    const connStateElement = document.getElementById('conn_state');
-                    switch (connState) {
-                        case 0:
-                            connStateElement.textContent = 'DISCONNECTED';
-                            connStateElement.style.color = 'red';
-                            break;
-                        case 1:
-                            connStateElement.textContent = 'DISABLED';
-                            connStateElement.style.color = 'red';
-                            break;
-                        case 2:
-                            connStateElement.textContent = 'INACTIVE';
-                            connStateElement.style.color = 'red';
-                            break;
-                        case 3:
-                            connStateElement.textContent = 'SCANNING';
-                            connStateElement.style.color = 'blue';
-                            break;
-                        case 4:
-                            connStateElement.textContent = 'AUTHENTICATING';
-                            connStateElement.style.color = 'blue';
-                            break;
-                        case 5:
-                            connStateElement.textContent = 'ASSOCIATING';
-                            connStateElement.style.color = 'blue';
-                            break;
-                        case 6:
-                            connStateElement.textContent = 'ASSOCIATED';
-                            connStateElement.style.color = 'green';
-                            break;
-                        case 7:
-                            connStateElement.textContent = '4-WAY-HANDSHAKE';
-                            connStateElement.style.color = 'blue';
-                            break;
-                        case 8:
-                            connStateElement.textContent = '4-WAY-GROUP-HANDSHAKE';
-                            connStateElement.style.color = 'blue';
-                            break;
-                        case 9:
-                            connStateElement.textContent = 'CONNECTED TO AP';
-                            connStateElement.style.color = 'green';
-                            break;
-                        default:
-                            connStateElement.textContent = data.response;
-                            connStateElement.style.color = 'black';
-                            break;
-                    }
-                });
+        function updateConnState(connState, rawConnState) {
+            const connStateElement = document.getElementById('conn_state');
+            switch (connState) {
+                case 0:
+                    connStateElement.textContent = 'DISCONNECTED';
+                    connStateElement.style.color = 'red';
+                    break;
+                case 1:
+                    connStateElement.textContent = 'DISABLED';
+                    connStateElement.style.color = 'red';
+                    break;
+                case 2:
+                    connStateElement.textContent = 'INACTIVE';
+                    connStateElement.style.color = 'red';
+                    break;
+                case 3:
+                    connStateElement.textContent = 'SCANNING';
+                    connStateElement.style.color = 'blue';
+                    break;
+                case 4:
+                    connStateElement.textContent = 'AUTHENTICATING';
+                    connStateElement.style.color = 'blue';
+                    break;
+                case 5:
+                    connStateElement.textContent = 'ASSOCIATING';
+                    connStateElement.style.color = 'blue';
+                    break;
+                case 6:
+                    connStateElement.textContent = 'ASSOCIATED';
+                    connStateElement.style.color = 'green';
+                    break;
+                case 7:
+                    connStateElement.textContent = '4-WAY-HANDSHAKE';
+                    connStateElement.style.color = 'blue';
+                    break;
+                case 8:
+                    connStateElement.textContent = '4-WAY-GROUP-HANDSHAKE';
+                    connStateElement.style.color = 'blue';
+                    break;
+                case 9:
+                    connStateElement.textContent = 'CONNECTED TO AP';
+                    connStateElement.style.color = 'green';
+                    break;
+                default:
+                    connStateElement.textContent = rawConnState;
+                    connStateElement.style.color = 'black';
+                    break;
+            }
         }
 
         function loadWiFiSettings() {
@@ -660,21 +881,53 @@ HTML_TEMPLATE = """
             });
         }
 
+        let surveyVersion = 0;
+        let surveyTable = {};
+        let surveyRunning = false;
+
         function runSiteSurvey() {
-            fetch('/command?cmd=get&param=scan_list')
+            if (surveyRunning) {
+                return;
+            }
+            surveyRunning = true;
+            // the server only sends rows that changed since the version we hold
+            fetch(`/survey?since=${surveyVersion}`, { method: 'POST' })
                 .then(response => response.json())
                 .then(data => {
-                    const responseText = data.response.replace(/^RESP:\\d+\\s*/, '').trim();
-                    const surveyResults = document.getElementById('surveyResults');
-                    surveyResults.innerHTML = ''; // Clear previous results
-
-                    const lines = responseText.split('\\n').slice(1); // Ignore the first line
-                    lines.forEach(line => {
-                        const [bssid, ssid, encryption, frequency, signal] = line.split('\t');
-                        const row = document.createElement('tr');
-                        row.innerHTML = `<td>${bssid}</td><td>${ssid}</td><td>${encryption}</td><td>${frequency}</td><td>${signal}</td>`;
-                        surveyResults.appendChild(row);
+                    if (data.status !== 'success') {
+                        return;
+                    }
+                    if (data.full) {
+                        surveyTable = {};
+                    }
+                    data.rows.forEach(values => {
+                        const ap = {};
+                        data.fields.forEach((field, i) => ap[field] = values[i]);
+                        surveyTable[ap.bssid] = ap;
                     });
+                    data.removed.forEach(bssid => delete surveyTable[bssid]);
+                    surveyVersion = data.version;
+                    renderSiteSurvey(data.time);
+                })
+                .finally(() => {
+                    surveyRunning = false;
+                    if (document.getElementById('surveyRepeat').checked) {
+                        setTimeout(runSiteSurvey, 1000);
+                    }
+                });
+        }
+
+        function renderSiteSurvey(now) {
+            const surveyResults = document.getElementById('surveyResults');
+            surveyResults.innerHTML = ''; // Clear previous results
+            Object.values(surveyTable)
+                .sort((a, b) => (b.signal || -999) - (a.signal || -999))
+                .forEach(ap => {
+                    const row = document.createElement('tr');
+                    const age = Math.round(now - ap.last_seen);
+                    row.innerHTML = `<td>${ap.bssid}</td><td>${ap.ssid}</td><td>${ap.encryption}</td><td>${ap.frequency}</td><td>${ap.signal}</td>` +
+                        `<td>${ap.rssi_min} / ${ap.rssi_avg} / ${ap.rssi_max}</td><td>${age}s ago</td>`;
+                    surveyResults.appendChild(row);
                 });
         }
 
@@ -701,7 +954,8 @@ HTML_TEMPLATE = """
                 if (data.status === 'success') {
                     alert('Mode switched successfully.');
                 } else {
-                    alert('Failed to switch mode.');
+                    alert('Failed to switch mode' + (data.error ? ': ' + data.error : '.'));
+                    loadMode();
                 }
             });
         }
@@ -712,11 +966,7 @@ HTML_TEMPLATE = """
         document.addEventListener('DOMContentLoaded', loadStationSettings);
         document.addEventListener('DOMContentLoaded', loadWiFiSettings);
         document.addEventListener('DOMContentLoaded', loadMode);
-        document.addEventListener('DOMContentLoaded', () => {
-            updateConnState();
-            connStateInterval = setInterval(updateConnState, 5000);
-            sendCommand('get', 'signal');
-        });
+        document.addEventListener('DOMContentLoaded', startLinkStream);
     </script>
     <script src="/static/jquery-3.5.1.min.js"></script>
     <script src="/static/bootstrap.bundle.min.js"></script>
@@ -727,30 +977,1187 @@ HTML_TEMPLATE = """
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+class Histogram:
+    def __init__(self, buckets=METRIC_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class MetricsRegistry:
+    # just enough of the prometheus text format for counters, gauges and histograms.
+    # with several workers each one publishes its counters to SHARED_STATE_DIR and a scrape
+    # adds them all up, otherwise the totals would jump between whichever worker answered
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.sources = []  # callables returning (name, labels, value) counters kept elsewhere
+        self.pid = os.getpid()
+        self.token = secrets.token_hex(4)
+        self.thread = None
+
+    def check_fork(self):
+        # caller holds the lock. a forked worker starts from zero, the parent's counts are not its own
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.token = secrets.token_hex(4)
+            self.counters = {}
+            self.histograms = {}
+            self.thread = None
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.check_fork()
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.check_fork()
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def state(self):
+        with self.lock:
+            self.check_fork()
+            counters = [[name, list(labels), value] for (name, labels), value in self.counters.items()]
+            histograms = [[name, list(labels), list(histogram.counts), histogram.sum, histogram.count]
+                          for (name, labels), histogram in self.histograms.items()]
+        for source in self.sources:
+            counters += [[name, list(labels), value] for name, labels, value in source()]
+        return {'counters': counters, 'histograms': histograms}
+
+    def share_name(self):
+        # pid plus a random token, a recycled pid must not overwrite a dead worker's totals
+        return os.path.join('metrics', f"{self.pid}-{self.token}.json")
+
+    def share(self):
+        try:
+            write_shared(self.share_name(), self.state())
+        except OSError as e:
+            print(f"Could not share metrics: {e}")
+
+    def start_sharing(self):
+        with self.lock:
+            self.check_fork()
+            if self.thread is not None:
+                return
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def run(self):
+        while True:
+            self.share()
+            time.sleep(METRICS_SHARE_INTERVAL)
+
+    def collect(self, shared):
+        states = [self.state()]
+        if shared:
+            # the files of finished workers stay, so the sums never go backwards
+            directory = os.path.join(SHARED_STATE_DIR, 'metrics')
+            own = os.path.basename(self.share_name())
+            try:
+                names = [name for name in os.listdir(directory) if name.endswith('.json') and name != own]
+            except OSError:
+                names = []
+            for name in names:
+                _, state = read_shared(os.path.join('metrics', name))
+                if state:
+                    states.append(state)
+        counters = {}
+        histograms = {}
+        for state in states:
+            for name, labels, value in state['counters']:
+                key = (name, tuple(tuple(pair) for pair in labels))
+                counters[key] = counters.get(key, 0) + value
+            for name, labels, counts, total, count in state['histograms']:
+                key = (name, tuple(tuple(pair) for pair in labels))
+                merged = histograms.get(key)
+                if merged is None:
+                    merged = histograms[key] = Histogram()
+                merged.counts = [a + b for a, b in zip(merged.counts, counts)]
+                merged.sum += total
+                merged.count += count
+        return counters, histograms
+
+    def render(self, gauges=(), shared=False):
+        samples = {}
+        for name, labels, value in gauges:
+            samples.setdefault(name, []).append((name, labels, value))
+        counters, histograms = self.collect(shared)
+        for (name, labels), value in counters.items():
+            samples.setdefault(name, []).append((name, labels, value))
+        for (name, labels), histogram in histograms.items():
+            lines = samples.setdefault(name, [])
+            total = 0
+            for bound, count in zip(histogram.buckets + ['+Inf'], histogram.counts):
+                total += count
+                lines.append((f"{name}_bucket", labels + (('le', str(bound)),), total))
+            lines.append((f"{name}_sum", labels, histogram.sum))
+            lines.append((f"{name}_count", labels, histogram.count))
+        output = []
+        for name in sorted(samples):
+            kind, text = METRIC_HELP.get(name, ('untyped', name))
+            output.append(f"# HELP {name} {text}")
+            output.append(f"# TYPE {name} {kind}")
+            for sample, labels, value in samples[name]:
+                output.append(f"{sample}{format_labels(labels)} {format_metric_value(value)}")
+        return '\n'.join(output) + '\n'
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    pairs = []
+    for key, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{key}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+def format_metric_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+metrics = MetricsRegistry()
+
+def spawn(command, program):
+    # fork+exec of the shell and waiting for the child show up as separate trace stages
+    if program not in SPAWN_PROGRAMS:
+        # /run_command takes any shell line, keep the label set bounded
+        program = 'other'
+    metrics.inc('taixin_subprocess_spawns_total', program=program)
+    with trace_span('spawn', program=program):
+        process = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    with trace_span('wait', program=program):
+        output, _ = process.communicate()
+    return process.returncode, output.decode()
+
 def run_command(command):
-    try:
-        output = subprocess.check_output(command, shell=True, stderr=subprocess.STDOUT).decode()
+    returncode, output = spawn(command, os.path.basename(command.split()[0]) if command.strip() else '')
+    if returncode == 0:
         output = re.sub(r'^RESP:\d+\s*', '', output)
-    except subprocess.CalledProcessError as e:
-        output = e.output.decode()
     return output
 
-def run_libnetat_command(command, cmd_type):
+def hgpriv_inproc_available():
+    # not cached, the driver may be loaded after the server starts
+    return hgpriv is not None and hgpriv.get_device() is not None
+
+def run_hgpriv_binary(cmd_type, param, value=None, ifname=IFNAME):
+    # used while the proc node is unavailable, e.g. during a driver reload
+    if not os.path.exists(HGPRIV_BIN):
+        return HGIC_MISSING
+    args = f"set {param}={value}" if cmd_type == 'set' else f"get {param}"
+    with hgpriv.iwpriv_locked() if hgpriv else contextlib.nullcontext():
+        return run_command(f"{HGPRIV_BIN} {ifname} {args}")
+
+def run_hgpriv_command(cmd_type, param, value=None, ifname=IFNAME, fmt=None):
+    # fmt is hex or base64 for binary payloads and binary replies, text forces a text reply
+    binary = fmt in ('hex', 'base64') or (hgpriv is not None and cmd_type == 'get' and param in hgpriv.BINARY_GETS
+                                          and fmt != 'text')
+    if not hgpriv_inproc_available():
+        # the binary only speaks text
+        return HGIC_MISSING if binary else run_hgpriv_binary(cmd_type, param, value, ifname)
+    if cmd_type == 'set' and fmt in ('hex', 'base64'):
+        try:
+            data = hgpriv.parse_payload(value or '', fmt)
+        except ValueError as e:
+            return f"Invalid {fmt} payload: {e}"
+        ret, buff = hgpriv.set_data(param, data, ifname)
+    elif cmd_type == 'set':
+        ret, buff = hgpriv.iwpriv_broker.call(f"{ifname} set {param}={value}")
+    else:
+        ret, buff = hgpriv.iwpriv_broker.call(f"{ifname} get {param}")
+    if ret < 0 and not binary:
+        # the proc write failed, hgpriv reopens the node on the next call
+        return run_hgpriv_binary(cmd_type, param, value, ifname)
+    if ret <= 0:
+        return NO_RESPONSE[0]
+    if cmd_type == 'get' and binary:
+        return hgpriv.format_payload(buff, fmt if fmt in ('hex', 'base64') else 'hex')
+    return hgpriv.format_payload(buff, 'text')
+
+class NetatSession:
+    def __init__(self, ifname, mgr=None):
+        self.ifname = ifname
+        self.lock = threading.Lock()
+        self.mgr = mgr or libnetat.NetatMgr(ifname)
+        self.dest = None
+
+    def select_device(self):
+        for device in self.mgr.netat_scan_iter(max_devices=1):
+            self.dest = device
+        return self.dest
+
+    def at(self, command, timeout_ms=NETAT_TIMEOUT_MS):
+        with self.lock:
+            if self.dest is None and self.select_device() is None:
+                return None
+            self.mgr.dest = self.dest
+            self.mgr.sock_flush()
+            self.mgr.netat_send(command)
+            response = self.mgr.netat_recv(timeout_ms, expecting_response=True)
+            if response is None:
+                # the module may have gone away, rescan on the next request
+                metrics.inc('taixin_netat_timeouts_total')
+                self.dest = None
+            return response
+
+    def batch(self, commands, timeout_ms=NETAT_TIMEOUT_MS):
+        with self.lock:
+            if self.dest is None and self.select_device() is None:
+                return None
+            self.mgr.dest = self.dest
+            self.mgr.sock_flush()
+            results = self.mgr.send_batch(commands, timeout_ms=timeout_ms)
+            lost = sum(1 for result in results if result['response'] is None)
+            if lost:
+                metrics.inc('taixin_netat_timeouts_total', lost)
+            return results
+
+    def fleet(self, commands, devices=None, timeout_ms=NETAT_TIMEOUT_MS):
+        with self.lock:
+            self.mgr.sock_flush()
+            return self.mgr.netat_fleet(commands, devices, timeout_ms=timeout_ms)
+
+def get_netat_session(ifname=IFNAME):
+    if libnetat is None:
+        return None
+    with NETAT_SESSIONS_LOCK:
+        session = NETAT_SESSIONS.get(ifname)
+        if session is None:
+            try:
+                session = NetatSession(ifname)
+            except OSError as e:
+                print(f"Could not open libnetat session on {ifname}: {e}")
+                return None
+            NETAT_SESSIONS[ifname] = session
+        return session
+
+def close_netat_sessions():
+    with NETAT_SESSIONS_LOCK:
+        for session in NETAT_SESSIONS.values():
+            session.mgr.sock.close()
+        NETAT_SESSIONS.clear()
+
+def parse_libnetat_output(output):
+    if 'valid cmds:' in output:
+        return "Invalid command in libnetat mode"
+    # Extract the actual value from the response
+    match = re.search(r'\+\w+:(.+?)\r?\nOK', output, re.DOTALL)
+    if match:
+        return match.group(1).strip()
+    return output.strip()
+
+def run_libnetat_command(command, cmd_type, ifname=IFNAME):
     if cmd_type == 'get':
         command = f"at+{command}?"
     elif cmd_type == 'set':
         command = f"at+{command}"
+    session = get_netat_session(ifname)
+    if session is None:
+        returncode, output = spawn(f"{LIBNETAT_BIN} {ifname} {command}", 'libnetat')
+        if returncode != 0:
+            return output
+    else:
+        output = session.at(command)
+        if output is None:
+            return NO_RESPONSE[1]
+    with trace_span('parse'):
+        return parse_libnetat_output(output)
+
+def observe_command(mode, cmd_type, param, output, elapsed):
+    # unknown params are folded together so user input cannot blow up the label set
+    if param not in GET_COMMANDS and param not in SET_COMMANDS:
+        param = 'other'
+    metrics.observe('taixin_command_duration_seconds', elapsed, mode=mode, cmd=cmd_type, param=param)
+    if output in NO_RESPONSE:
+        metrics.inc('taixin_command_errors_total', mode=mode, param=param, reason='no_response')
+    elif output == HGIC_MISSING:
+        metrics.inc('taixin_command_errors_total', mode=mode, param=param, reason='driver_missing')
+
+def radio_command(cmd_type, param, value=None, mode=None, ifname=IFNAME, fmt=None):
+    mode = mode or load_mode()
+    name = param
+    start = time.monotonic()
+    with trace_span('radio_command', mode=mode, cmd=cmd_type, param=param):
+        if mode == 'hgpriv':
+            output = run_hgpriv_command(cmd_type, param, value, ifname, fmt)
+        elif mode == 'libnetat':
+            # Remap command if necessary
+            param = COMMAND_REMAP.get(param, param)
+            if cmd_type == 'get':
+                output = run_libnetat_command(param, 'get', ifname)
+            else:
+                output = run_libnetat_command(f"{param}={value}", 'set', ifname)
+        else:
+            return "Invalid mode"
+    observe_command(mode, cmd_type, name, output, time.monotonic() - start)
+    if cmd_type == 'set' and param in STATUS_PARAMS:
+        status_sampler.invalidate()
+    return output
+
+def radio_get_many(params, mode=None, ifname=IFNAME):
+    mode = mode or load_mode()
+    if mode == 'libnetat':
+        session = get_netat_session(ifname)
+        results = session.batch([f"at+{COMMAND_REMAP.get(param, param)}?" for param in params]) if session else None
+        if results is not None:
+            return {param: parse_libnetat_output(result['response']) if result['response'] else None
+                    for param, result in zip(params, results)}
+    elif mode == 'hgpriv' and hgpriv_inproc_available():
+        # one batch through the broker, a failed read comes back as None
+        return hgpriv.get_many(params, ifname, raw=True)
+    return {param: radio_command('get', param, mode=mode, ifname=ifname) for param in params}
+
+def radio_set_many(items, mode=None, ifname=IFNAME):
+    mode = mode or load_mode()
+    if mode == 'libnetat':
+        session = get_netat_session(ifname)
+        results = session.batch([f"at+{key}={value}" for key, value in items]) if session else None
+        if results is not None:
+            status_sampler.invalidate()
+            return {key: parse_libnetat_output(result['response']) if result['response'] else None
+                    for (key, _), result in zip(items, results)}
+    return {key: radio_command('set', key, value, mode=mode, ifname=ifname) for key, value in items}
+
+def netat_command(cmd_type, param, value=None):
+    param = COMMAND_REMAP.get(param, param)
+    if cmd_type == 'get':
+        return f"at+{param}?"
+    return f"at+{param}={value}"
+
+def run_command_batch(ops, mode=None, ifname=IFNAME):
+    mode = mode or load_mode()
+    results = [None] * len(ops)
+
+    def result(op, response, error, latency_ms):
+        return {'cmd': op['cmd'], 'param': op['param'], 'response': response, 'error': error, 'latency_ms': latency_ms}
+
+    todo = []
+    snapshot = status_sampler.data if status_sampler.fresh() else None
+    for i, op in enumerate(ops):
+        if op['cmd'] == 'set':
+            # anything after a set has to see what the set did
+            snapshot = None
+        if snapshot and op['cmd'] == 'get' and op['param'] in STATUS_PARAMS:
+            results[i] = result(op, snapshot['settings'][op['param']], None, 0)
+        else:
+            todo.append(i)
+    sets = any(ops[i]['cmd'] == 'set' for i in todo)
+
+    if mode == 'libnetat':
+        # the whole batch goes out pipelined on the shared netat session
+        session = get_netat_session(ifname)
+        commands = [netat_command(ops[i]['cmd'], ops[i]['param'], ops[i].get('value')) for i in todo]
+        batch = session.batch(commands) if session and commands else None
+        if batch is not None:
+            for i, reply in zip(todo, batch):
+                response = parse_libnetat_output(reply['response']) if reply['response'] else None
+                error = None if libnetat.netat_response_ok(reply['response']) else (response or NO_RESPONSE[1])
+                results[i] = result(ops[i], response, error, reply['latency_ms'])
+            if sets:
+                status_sampler.invalidate()
+            return results
+
+    def run(i):
+        op = ops[i]
+        start = time.monotonic()
+        try:
+            response = radio_command(op['cmd'], op['param'], op.get('value'), mode=mode, ifname=ifname)
+            error = response if response in NO_RESPONSE else None
+        except Exception as e:
+            response = None
+            error = str(e)
+        results[i] = result(op, response, error, (time.monotonic() - start) * 1000)
+
+    if mode == 'hgpriv':
+        # the proc node serializes everything anyway and each call is cheap
+        for i in todo:
+            run(i)
+        if sets:
+            status_sampler.invalidate()
+        return results
+
+    # libnetat subprocess fallback: reads between two sets run concurrently, sets keep their order
+    with ThreadPoolExecutor(BATCH_WORKERS) as pool:
+        group = []
+        for i in todo:
+            if ops[i]['cmd'] == 'set':
+                list(pool.map(run, group))
+                group = []
+                run(i)
+            else:
+                group.append(i)
+        list(pool.map(run, group))
+    if sets:
+        status_sampler.invalidate()
+    return results
+
+def write_shared(name, data):
+    path = os.path.join(SHARED_STATE_DIR, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, 'w') as f:
+        json.dump(data, f)
+        f.flush()
+        # taken from the file we wrote, a stat after the rename could see another worker's write
+        mtime = os.fstat(f.fileno()).st_mtime
+    os.replace(tmp, path)
+    return mtime
+
+def read_shared(name):
+    path = os.path.join(SHARED_STATE_DIR, name)
+    try:
+        with open(path, 'r') as f:
+            return os.fstat(f.fileno()).st_mtime, json.load(f)
+    except (OSError, ValueError):
+        return None, None
+
+sampler_lock = threading.Lock()
+sampler_lock_fd = None
+sampler_lock_pid = None
+
+def sampler_leader():
+    # with several worker processes only the one holding this lock samples the radio,
+    # the others pick its snapshots up from SHARED_STATE_DIR
+    global sampler_lock_fd, sampler_lock_pid
+    with sampler_lock:
+        if sampler_lock_pid != os.getpid():
+            sampler_lock_pid = os.getpid()
+            sampler_lock_fd = None
+        if sampler_lock_fd is not None:
+            return True
+        try:
+            os.makedirs(SHARED_STATE_DIR, exist_ok=True)
+            fd = os.open(os.path.join(SHARED_STATE_DIR, 'sampler.lock'), os.O_RDWR | os.O_CREAT, 0o644)
+        except OSError:
+            return True
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        sampler_lock_fd = fd
+        return True
+
+@contextlib.contextmanager
+def shared_lock(name):
+    # serializes one step across the worker processes, released when the fd is closed
+    os.makedirs(SHARED_STATE_DIR, exist_ok=True)
+    fd = os.open(os.path.join(SHARED_STATE_DIR, f"{name}.lock"), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)
+
+def try_shared_lock(name):
+    # non blocking, returns the fd holding the lock or None if another thread or worker has it
+    os.makedirs(SHARED_STATE_DIR, exist_ok=True)
+    fd = os.open(os.path.join(SHARED_STATE_DIR, f"{name}.lock"), os.O_RDWR | os.O_CREAT, 0o644)
     try:
-        output = subprocess.check_output(f"/sbin/libnetat hg0 {command}", shell=True, stderr=subprocess.STDOUT).decode()
-        if 'valid cmds:' in output:
-            return "Invalid command in libnetat mode"
-        # Extract the actual value from the response
-        match = re.search(r'\+\w+:(.+?)\nOK', output, re.DOTALL)
-        if match:
-            return match.group(1).strip()
-        return output.strip()
-    except subprocess.CalledProcessError as e:
-        return e.output.decode()
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        os.close(fd)
+        return None
+    return fd
+
+def shared_mtime(name):
+    try:
+        return os.stat(os.path.join(SHARED_STATE_DIR, name)).st_mtime
+    except OSError:
+        return None
+
+class Sampler:
+    def __init__(self, ttl, name=None):
+        self.ttl = ttl
+        self.name = name  # named samplers share their snapshot with the other workers
+        self.lock = threading.Lock()
+        self.refresh_lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.data = None
+        self.previous = None  # last real snapshot, served by followers if the leader is slow
+        self.updated = 0
+        self.shared_mtime = None
+        self.thread = None
+        self.stopped = False
+        self.subscribers = []
+
+    def sample(self):
+        raise NotImplementedError
+
+    def fresh(self):
+        return self.data is not None and time.monotonic() - self.updated < self.ttl
+
+    def store(self, data, age=0):
+        with self.lock:
+            self.data = data
+            self.updated = time.monotonic() - age
+            if data is not None:
+                self.previous = data
+            subscribers = list(self.subscribers)
+        if data is None:
+            return
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(data)
+            except queue.Full:
+                # slow client, drop its oldest sample rather than block the sampler
+                try:
+                    subscriber.get_nowait()
+                except queue.Empty:
+                    pass
+                subscriber.put_nowait(data)
+
+    def share(self, data):
+        if self.name is None:
+            return
+        try:
+            self.shared_mtime = write_shared(f"{self.name}.json", data)
+        except OSError as e:
+            print(f"Could not share {self.name} snapshot: {e}")
+
+    def load_shared(self):
+        if self.name is None:
+            return
+        mtime, data = read_shared(f"{self.name}.json")
+        if mtime is None or mtime == self.shared_mtime:
+            return
+        self.shared_mtime = mtime
+        self.store(data, age=max(time.time() - mtime, 0))
+
+    def refresh(self, force=True):
+        with self.refresh_lock:
+            if not force and self.fresh():
+                return self.data
+            start = time.monotonic()
+            data = self.sample()
+            metrics.observe('taixin_sampler_refresh_seconds', time.monotonic() - start, sampler=self.name or type(self).__name__)
+            self.store(data)
+            self.share(data)
+            return data
+
+    def get(self):
+        self.start()
+        self.load_shared()
+        with self.lock:
+            if self.fresh():
+                return self.data
+        if self.name is not None and not sampler_leader():
+            return self.wait_shared()
+        return self.refresh(force=False)
+
+    def wait_shared(self):
+        # only the leader samples, a follower waits for its next snapshot
+        deadline = time.monotonic() + FOLLOWER_WAIT
+        while time.monotonic() < deadline:
+            time.sleep(SHARED_POLL_INTERVAL / 2)
+            self.load_shared()
+            with self.lock:
+                if self.fresh():
+                    return self.data
+        if sampler_leader() or self.previous is None:
+            # the old leader went away while we waited, or nothing was ever shared:
+            # sample here rather than hand callers nothing
+            return self.refresh(force=False)
+        return self.data if self.data is not None else self.previous
+
+    def invalidate(self):
+        with self.lock:
+            self.data = None
+        # a null snapshot tells the leader to resample and the other workers to wait for it
+        self.share(None)
+        self.wakeup.set()
+
+    def wait(self, timeout):
+        # the leader also wakes up when another worker replaced its snapshot with a null one
+        deadline = time.monotonic() + timeout
+        while not self.wakeup.wait(min(SHARED_POLL_INTERVAL, max(deadline - time.monotonic(), 0))):
+            if time.monotonic() >= deadline:
+                break
+            if self.name is not None and shared_mtime(f"{self.name}.json") != self.shared_mtime:
+                break
+        self.wakeup.clear()
+
+    def subscribe(self):
+        subscriber = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        with self.lock:
+            self.subscribers.append(subscriber)
+        self.start()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            if subscriber in self.subscribers:
+                self.subscribers.remove(subscriber)
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        # final, a stopped sampler is dropped and a new one made if needed
+        self.stopped = True
+        self.wakeup.set()
+
+    def run(self):
+        while not self.stopped:
+            if self.name is not None and not sampler_leader():
+                self.load_shared()
+                self.wakeup.wait(self.ttl / 4)
+                self.wakeup.clear()
+                continue
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"{type(self).__name__} failed: {e}")
+            # resample at half the ttl so readers never see an expired snapshot
+            self.wait(self.ttl / 2)
+
+class StatusSampler(Sampler):
+    def sample(self):
+        mode = load_mode()
+        settings = {param: radio_command('get', param, mode=mode).strip() for param in STATUS_PARAMS}
+        return {
+            'mode': mode,
+            'settings': settings,
+            'network': get_current_network_settings(),
+            'time': time.time(),
+        }
+
+status_sampler = StatusSampler(STATUS_TTL, 'status')
+
+def parse_response(param, text):
+    # typed values come from the hgpriv parsers, the text looks the same in both modes
+    if hgpriv is None:
+        return text.strip() if text is not None else None
+    with trace_span('parse', param=param):
+        return hgpriv.parse_value(param, text)
+
+def radio_value(param, mode=None, ifname=IFNAME):
+    return parse_response(param, radio_command('get', param, mode=mode, ifname=ifname))
+
+history_store = None
+history_lock = threading.Lock()
+
+def get_history_store():
+    global history_store
+    with history_lock:
+        if history_store is None:
+            try:
+                history_store = history.HistoryStore(HISTORY_DIR)
+            except OSError as e:
+                print(f"History disabled, cannot open {HISTORY_DIR}: {e}")
+                history_store = False
+        return history_store or None
+
+def record_history(t, values):
+    store = get_history_store()
+    if store is None or not sampler_leader():
+        return
+    for metric, value in values.items():
+        if value is not None:
+            store.add(metric, value, t)
+
+class LinkSampler(Sampler):
+    def __init__(self, ifname, interval=LINK_SAMPLE_INTERVAL):
+        # only the default interface is shared, the leader does not run samplers for the others
+        super().__init__(interval * 2, f"link_{ifname}" if ifname == IFNAME else None)
+        self.ifname = ifname
+
+    def unsubscribe(self, subscriber):
+        # samplers for other interfaces only run while someone is watching
+        with link_samplers_lock:
+            super().unsubscribe(subscriber)
+            if self.ifname != IFNAME and not self.subscribers and link_samplers.get(self.ifname) is self:
+                del link_samplers[self.ifname]
+                self.stop()
+
+    def sample(self):
+        mode = load_mode()
+        signal = radio_command('get', 'signal', mode=mode, ifname=self.ifname).strip()
+        conn_state = radio_command('get', 'conn_state', mode=mode, ifname=self.ifname).strip()
+        state = parse_response('conn_state', conn_state)
+        data = {
+            'time': time.time(),
+            'signal': parse_response('signal', signal),
+            'signal_raw': signal,
+            'conn_state': state['state'] if state else None,
+            'conn_state_name': state['name'] if state else None,
+            'conn_state_raw': conn_state,
+        }
+        if self.ifname == IFNAME:
+            record_history(data['time'], {'signal': data['signal'], 'conn_state': data['conn_state']})
+        return data
+
+class TelemetrySampler(Sampler):
+    def sample(self):
+        mode = load_mode()
+        data = {param: radio_value(param, mode=mode) for param in TELEMETRY_PARAMS}
+        data['time'] = time.time()
+        record_history(data['time'], {param: data[param] for param in TELEMETRY_PARAMS})
+        return data
+
+telemetry_sampler = TelemetrySampler(TELEMETRY_INTERVAL * 2, 'telemetry')
+
+class StationTable:
+    # fixed size rings per station slot, so 100+ stations cost a few flat arrays, not dicts per sample
+    MISSING = -32768
+    RATE_MISSING = -1.0  # rates are never negative
+
+    def __init__(self, slots=STATION_SLOTS, history=STATION_HISTORY):
+        self.slots = slots
+        self.history = history
+        self.index = {}
+        self.macs = [None] * slots
+        self.fields = [None] * slots
+        self.rssi = array.array('h', [self.MISSING]) * (slots * history)
+        self.rate = array.array('f', [self.RATE_MISSING]) * (slots * history)
+        self.head = array.array('H', [0]) * slots
+        self.count = array.array('H', [0]) * slots
+        self.first_seen = array.array('d', [0.0]) * slots
+        self.last_seen = array.array('d', [0.0]) * slots
+        self.free = list(range(slots - 1, -1, -1))
+
+    def slot(self, mac, now):
+        slot = self.index.get(mac)
+        if slot is not None:
+            return slot
+        if not self.free:
+            self.release(min(self.index.values(), key=lambda i: self.last_seen[i]))
+        slot = self.free.pop()
+        self.index[mac] = slot
+        self.macs[slot] = mac
+        self.head[slot] = 0
+        self.count[slot] = 0
+        self.first_seen[slot] = now
+        return slot
+
+    def release(self, slot):
+        del self.index[self.macs[slot]]
+        self.macs[slot] = None
+        self.fields[slot] = None
+        self.free.append(slot)
+
+    def update(self, mac, rssi, rate, fields, now):
+        slot = self.slot(mac, now)
+        i = slot * self.history + self.head[slot]
+        self.rssi[i] = self.MISSING if rssi is None else max(min(int(rssi), 32767), -32767)
+        self.rate[i] = self.RATE_MISSING if rate is None else float(rate)
+        self.head[slot] = (self.head[slot] + 1) % self.history
+        self.count[slot] = min(self.count[slot] + 1, self.history)
+        self.last_seen[slot] = now
+        self.fields[slot] = fields
+
+    def expire(self, now, max_age=STATION_MAX_AGE):
+        for slot in list(self.index.values()):
+            if now - self.last_seen[slot] > max_age:
+                self.release(slot)
+
+    def stats(self, slot):
+        count = self.count[slot]
+        base = slot * self.history
+        # walk the ring newest first
+        order = [base + (self.head[slot] - 1 - n) % self.history for n in range(count)]
+        rssi = [self.rssi[i] for i in order if self.rssi[i] != self.MISSING]
+        rate = [self.rate[i] for i in order if self.rate[i] != self.RATE_MISSING]
+        return {
+            'mac': self.macs[slot],
+            'rssi': rssi[0] if rssi else None,
+            'rssi_min': min(rssi) if rssi else None,
+            'rssi_avg': round(sum(rssi) / len(rssi), 1) if rssi else None,
+            'rssi_max': max(rssi) if rssi else None,
+            'rate': rate[0] if rate else None,
+            'rate_avg': round(sum(rate) / len(rate), 1) if rate else None,
+            'samples': count,
+            'first_seen': self.first_seen[slot],
+            'last_seen': self.last_seen[slot],
+            'fields': self.fields[slot],
+        }
+
+    def snapshot(self):
+        return [self.stats(slot) for slot in sorted(self.index.values(), key=lambda i: self.macs[i])]
+
+def first_number(fields, keys):
+    for key in keys:
+        value = fields.get(key)
+        if isinstance(value, (int, float)):
+            return value
+    return None
+
+class StationSampler(Sampler):
+    # one sta_count, sta_list and stainfo read per tick however many stations are associated
+    def __init__(self, ttl, name=None):
+        super().__init__(ttl, name)
+        self.table = StationTable()
+        self.ticks = 0
+        self.total_ms = 0.0
+
+    def sample(self):
+        mode = load_mode()
+        start = time.monotonic()
+        cost = {}
+
+        def timed(stage, param):
+            stage_start = time.monotonic()
+            value = radio_value(param, mode=mode)
+            cost[stage] = round((time.monotonic() - stage_start) * 1000, 2)
+            return value
+
+        sta_count = timed('sta_count', 'sta_count')
+        stations = {}
+        if sta_count != 0:
+            for station in timed('sta_list', 'sta_list') or []:
+                stations[station['mac']] = dict(station)
+            # stainfo lines carry the per station link figures, merged over the sta_list entry
+            stage_start = time.monotonic()
+            for station in hgpriv.parse_sta_list(radio_command('get', 'stainfo', mode=mode)) if hgpriv else []:
+                stations.setdefault(station['mac'], {}).update(station)
+            cost['stainfo'] = round((time.monotonic() - stage_start) * 1000, 2)
+
+        merge_start = time.monotonic()
+        now = time.time()
+        for mac, fields in stations.items():
+            fields.pop('mac', None)
+            self.table.update(mac, first_number(fields, STATION_RSSI_KEYS), first_number(fields, STATION_RATE_KEYS), fields, now)
+        self.table.expire(now)
+        snapshot = self.table.snapshot()
+        cost['merge'] = round((time.monotonic() - merge_start) * 1000, 2)
+
+        elapsed = (time.monotonic() - start) * 1000
+        self.ticks += 1
+        self.total_ms += elapsed
+        return {
+            'time': now,
+            'sta_count': sta_count,
+            'stations': snapshot,
+            'tick': {'ms': round(elapsed, 2), 'stages_ms': cost, 'stations': len(stations),
+                     'ticks': self.ticks, 'avg_ms': round(self.total_ms / self.ticks, 2)},
+        }
+
+station_sampler = StationSampler(STATION_INTERVAL * 2, 'stations')
+
+link_samplers = {}
+link_samplers_lock = threading.Lock()
+
+def get_link_sampler(ifname=IFNAME):
+    with link_samplers_lock:
+        sampler = link_samplers.get(ifname)
+        if sampler is None:
+            sampler = link_samplers[ifname] = LinkSampler(ifname)
+        return sampler
+
+def link_stream(ifname):
+    # looked up and subscribed in one step, so the last client leaving cannot stop it in between
+    with link_samplers_lock:
+        sampler = link_samplers.get(ifname)
+        if sampler is None:
+            sampler = link_samplers[ifname] = LinkSampler(ifname)
+        latest = sampler.data
+        subscriber = sampler.subscribe()
+    return sse_response(sampler, subscriber, [latest] if latest is not None else [])
+
+def interface_exists(ifname):
+    return ifname == IFNAME or (re.fullmatch(r'[\w.-]{1,15}', ifname) is not None
+                                and os.path.isdir(os.path.join('/sys/class/net', ifname)))
+
+class SiteSurvey:
+    # merges repeated scan_list reads into one table keyed by bssid. every merge bumps
+    # the version, so callers only get the rows that changed since the version they hold
+    def __init__(self, max_age=SURVEY_MAX_AGE, name=None):
+        self.max_age = max_age
+        self.name = name  # a named survey keeps its table in SHARED_STATE_DIR so every worker hands out the same versions
+        self.lock = threading.Lock()
+        self.scan_lock = threading.Lock()
+        self.table = {}
+        self.removed = {}
+        self.version = 0
+        self.floor = 0  # deltas from before this version need the full table
+        self.scanned = 0
+        self.shared_mtime = None
+
+    def load_shared(self):
+        # caller holds the lock
+        if self.name is None:
+            return
+        mtime, state = read_shared(f"{self.name}.json")
+        if state is None or mtime == self.shared_mtime:
+            return
+        self.shared_mtime = mtime
+        self.table = state['table']
+        self.removed = state['removed']
+        self.version = state['version']
+        self.floor = state['floor']
+        self.scanned = state['scanned']
+
+    def share(self):
+        # caller holds the lock
+        if self.name is None:
+            return
+        state = {'table': self.table, 'removed': self.removed, 'version': self.version,
+                 'floor': self.floor, 'scanned': self.scanned}
+        try:
+            self.shared_mtime = write_shared(f"{self.name}.json", state)
+        except OSError as e:
+            print(f"Could not share {self.name} table: {e}")
+
+    def read_scan_list(self, mode):
+        rows = radio_value('scan_list', mode=mode)
+        return rows if isinstance(rows, list) else []
+
+    def scan(self, mode=None):
+        mode = mode or load_mode()
+        scan_lock = shared_lock(self.name) if self.name else contextlib.nullcontext()
+        with self.scan_lock, scan_lock:
+            with self.lock:
+                self.load_shared()
+                if time.time() - self.scanned < SURVEY_MIN_INTERVAL:
+                    return self.version
+            radio_command('set', 'hwscan', SURVEY_HWSCAN_ARGS, mode=mode)
+            time.sleep(SURVEY_SCAN_WAIT)
+            # the list fills in while the scan runs, read until two reads agree
+            deadline = time.monotonic() + SURVEY_POLL_TIMEOUT
+            rows = self.read_scan_list(mode)
+            while time.monotonic() < deadline:
+                time.sleep(SURVEY_POLL_INTERVAL)
+                again = self.read_scan_list(mode)
+                settled = again == rows
+                rows = again
+                if settled:
+                    break
+            return self.merge(rows)
+
+    def merge(self, rows, now=None):
+        now = now or time.time()
+        with self.lock:
+            self.load_shared()
+            self.scanned = time.time()
+            self.version += 1
+            for row in rows:
+                bssid = row['bssid']
+                record = self.table.get(bssid)
+                if record is None:
+                    record = self.table[bssid] = {'bssid': bssid, 'first_seen': now, 'seen': 0, 'rssi_sum': 0,
+                                                  'rssi_count': 0, 'rssi_min': None, 'rssi_max': None,
+                                                  'shown': None, 'sent': 0}
+                    self.removed.pop(bssid, None)
+                # only a change the table shows puts the row into the next delta
+                shown = [row['ssid'], row['encryption'], row['frequency'], row['signal']]
+                if shown != record['shown'] or now - record['sent'] >= SURVEY_SEEN_BUCKET:
+                    record.update(shown=shown, sent=now, version=self.version)
+                record.update(ssid=row['ssid'], encryption=row['encryption'], frequency=row['frequency'],
+                              signal=row['signal'], last_seen=now)
+                record['seen'] += 1
+                signal = row['signal']
+                if signal is not None:
+                    record['rssi_min'] = signal if record['rssi_min'] is None else min(record['rssi_min'], signal)
+                    record['rssi_max'] = signal if record['rssi_max'] is None else max(record['rssi_max'], signal)
+                    record['rssi_sum'] += signal
+                    record['rssi_count'] += 1
+                record['rssi_avg'] = round(record['rssi_sum'] / record['rssi_count'], 1) if record['rssi_count'] else None
+            for bssid, record in list(self.table.items()):
+                if now - record['last_seen'] > self.max_age:
+                    del self.table[bssid]
+                    self.removed[bssid] = self.version
+            while len(self.removed) > SURVEY_TOMBSTONES:
+                bssid = min(self.removed, key=self.removed.get)
+                self.floor = max(self.floor, self.removed.pop(bssid))
+            self.share()
+            return self.version
+
+    def delta(self, since=0):
+        with self.lock:
+            self.load_shared()
+            full = since <= self.floor or since > self.version
+            if full:
+                since = 0
+            rows = [[record[field] for field in SURVEY_FIELDS]
+                    for record in self.table.values() if record['version'] > since]
+            removed = [bssid for bssid, version in self.removed.items() if version > since]
+            return {'version': self.version, 'full': full, 'time': time.time(), 'fields': SURVEY_FIELDS,
+                    'rows': rows, 'removed': [] if full else removed}
+
+site_survey = SiteSurvey(name='survey')
+
+def sse_response(source, subscriber, backlog=()):
+    def events():
+        try:
+            for data in backlog:
+                yield f"data: {json.dumps(data)}\n\n"
+            while True:
+                try:
+                    data = subscriber.get(timeout=SSE_KEEPALIVE)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"data: {json.dumps(data)}\n\n"
+        finally:
+            source.unsubscribe(subscriber)
+
+    return Response(events(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def sse_stream(sampler):
+    latest = sampler.data
+    subscriber = sampler.subscribe()
+    return sse_response(sampler, subscriber, [latest] if latest is not None else [])
+
+class NetlogJournal:
+    # only one worker can bind the netlog port. it appends every line to a json lines file
+    # in SHARED_STATE_DIR and the other workers tail that file, so /netlog looks the same
+    # whichever worker serves it
+    def __init__(self, name=NETLOG_JOURNAL):
+        self.path = os.path.join(SHARED_STATE_DIR, name)
+        self.lock = threading.Lock()
+        self.file = None
+        self.lines = deque(maxlen=NETLOG_JOURNAL_ENTRIES)
+        self.inode = None
+        self.offset = 0
+        self.partial = b''
+        self.subscribers = []
+        self.thread = None
+
+    def append(self, entry):
+        # collector thread only
+        if self.file is None:
+            os.makedirs(SHARED_STATE_DIR, exist_ok=True)
+            self.file = open(self.path, 'ab')
+        if self.file.tell() > NETLOG_JOURNAL_BYTES:
+            self.file.close()
+            os.replace(self.path, f"{self.path}.1")
+            self.file = open(self.path, 'ab')
+        self.file.write(json.dumps(entry).encode() + b'\n')
+        self.file.flush()
+
+    def read_from(self, path, offset):
+        try:
+            with open(path, 'rb') as f:
+                f.seek(offset)
+                data = f.read()
+        except OSError:
+            return []
+        self.offset = offset + len(data)
+        lines = (self.partial + data).split(b'\n')
+        self.partial = lines.pop()
+        entries = []
+        for line in lines:
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                continue
+        return entries
+
+    def poll(self):
+        # caller holds the lock, returns the entries that are new since the last poll
+        try:
+            inode = os.stat(self.path).st_ino
+        except OSError:
+            return []
+        entries = []
+        if inode != self.inode:
+            # rotated: finish the old file from where we were, or start with the previous segment
+            try:
+                old = os.stat(f"{self.path}.1").st_ino
+            except OSError:
+                old = None
+            if old is not None and (self.inode is None or old == self.inode):
+                entries += self.read_from(f"{self.path}.1", self.offset if self.inode is not None else 0)
+            self.inode = inode
+            self.offset = 0
+            self.partial = b''
+        entries += self.read_from(self.path, self.offset)
+        self.lines.extend(entries)
+        return entries
+
+    def collect(self, device, since):
+        # caller holds the lock
+        return [entry for entry in self.lines if entry['seq'] > since and device in (None, entry['device'])]
+
+    def entries(self, device=None, since=0, limit=None):
+        with self.lock:
+            self.poll()
+            entries = self.collect(device, since)
+        return entries[-limit:] if limit else entries
+
+    def devices(self):
+        with self.lock:
+            self.poll()
+            counts = {}
+            for entry in self.lines:
+                counts[entry['device']] = counts.get(entry['device'], 0) + 1
+            return counts
+
+    def subscribe(self, device=None, since=None):
+        subscriber = queue.Queue(maxsize=NETLOG_QUEUE_SIZE)
+        with self.lock:
+            self.poll()
+            backlog = self.collect(device, since) if since is not None else []
+            self.subscribers.append((subscriber, device))
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+        return subscriber, backlog
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers = [item for item in self.subscribers if item[0] is not subscriber]
+
+    def run(self):
+        while True:
+            time.sleep(SHARED_POLL_INTERVAL)
+            with self.lock:
+                entries = self.poll()
+                subscribers = list(self.subscribers)
+            for entry in entries:
+                for subscriber, device in subscribers:
+                    if device in (None, entry['device']):
+                        try:
+                            subscriber.put_nowait(entry)
+                        except queue.Full:
+                            pass
+
+netlog_collector = None
+netlog_journal = None
+netlog_lock = threading.Lock()
+
+def get_netlog_collector():
+    # with several workers the sampler leader binds the netlog port and writes the journal,
+    # every other worker reads the journal. a single process needs no journal.
+    # retried on the next call if the port was busy
+    global netlog_collector, netlog_journal
+    with netlog_lock:
+        if netlog_collector is not None:
+            return netlog_collector
+        shared = WORKERS > 1
+        if shared and netlog_journal is None:
+            netlog_journal = NetlogJournal()
+        if libnetat is None:
+            return netlog_journal
+        if shared and not sampler_leader():
+            return netlog_journal
+        try:
+            collector = libnetat.NetlogCollector(IFNAME, directory=NETLOG_DIR,
+                                                 on_entry=netlog_journal.append if shared else None)
+        except OSError as e:
+            print(f"Netlog collector unavailable: {e}")
+            return None
+        if shared:
+            # a worker that took over from a dead leader carries on its sequence numbers
+            with netlog_journal.lock:
+                netlog_journal.poll()
+                collector.restore(list(netlog_journal.lines))
+        collector.start()
+        netlog_collector = collector
+        return netlog_collector
 
 def load_last_settings():
     if os.path.exists(LAST_SETTINGS_FILE):
@@ -762,25 +2169,65 @@ def save_settings(settings):
     with open(LAST_SETTINGS_FILE, 'w') as f:
         json.dump(settings, f)
 
-def apply_settings(settings):
-    mode = load_mode()
-    for key, value in settings.items():
-        if mode == 'hgpriv':
-            command = f"/sbin/hgpriv hg0 set {key}={value}"
-            run_command(command)
-        elif mode == 'libnetat':
-            command = f"{key}={value}"
-            run_libnetat_command(command, 'set')
+def settings_order(key):
+    return SETTINGS_ORDER.index(key) if key in SETTINGS_ORDER else len(SETTINGS_ORDER)
 
-def get_current_network_settings():
-    ip_address = run_command("ifconfig hg0 | grep 'inet ' | awk '{print $2}'").strip()
-    netmask = run_command("ifconfig hg0 | grep 'inet ' | awk '{print $4}'").strip()
-    gateway = run_command("ip route | grep default | awk '{print $3}'").strip()
+def apply_settings(settings, force=False):
+    # only write keys whose current value differs, some of them make the radio drop the link
+    mode = load_mode()
+    keys = sorted(settings, key=settings_order)
+    current = {} if force else radio_get_many([key for key in keys if key in GET_COMMANDS], mode)
+    for key, text in current.items():
+        # a failed read is an unknown value, not the value the radio had
+        if text is None or text.strip() in NO_RESPONSE or text.strip() == HGIC_MISSING:
+            current[key] = None
+    report = {'changed': {}, 'unchanged': [], 'unverified': [], 'responses': {}}
+    pending = []
+    for key in keys:
+        value = str(settings[key]).strip()
+        if force:
+            report['changed'][key] = {'from': None, 'to': value}
+        elif key not in current:
+            report['unverified'].append(key)
+        elif current[key] is not None and current[key].strip() == value:
+            report['unchanged'].append(key)
+            continue
+        else:
+            report['changed'][key] = {'from': current[key], 'to': value}
+        pending.append((key, value))
+    if pending:
+        report['responses'] = radio_set_many(pending, mode)
+        status_sampler.invalidate()
+    return report
+
+def get_current_network_settings(ifname=IFNAME):
+    ip_address = ''
+    netmask = ''
+    gateway = ''
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        ifreq = struct.pack('256s', ifname.encode()[:15])
+        ip_address = socket.inet_ntoa(fcntl.ioctl(sock.fileno(), 0x8915, ifreq)[20:24])  # SIOCGIFADDR
+        netmask = socket.inet_ntoa(fcntl.ioctl(sock.fileno(), 0x891b, ifreq)[20:24])  # SIOCGIFNETMASK
+    except OSError:
+        pass
+    finally:
+        sock.close()
+    try:
+        with open('/proc/net/route', 'r') as f:
+            for line in f.readlines()[1:]:
+                fields = line.split()
+                if len(fields) > 3 and fields[1] == '00000000' and int(fields[3], 16) & 0x2:
+                    gateway = socket.inet_ntoa(struct.pack('<I', int(fields[2], 16)))
+                    break
+    except (OSError, ValueError):
+        pass
     return {'ip_address': ip_address, 'netmask': netmask, 'gateway': gateway}
 
 def set_network_settings(ip_address, netmask, gateway):
     run_command(f"ifconfig hg0 {ip_address} netmask {netmask}")
     run_command(f"route add default gw {gateway}")
+    status_sampler.invalidate()
 
 def load_station_settings():
     settings = {}
@@ -835,47 +2282,476 @@ def save_mode(mode):
     with open(MODE_FILE, 'w') as f:
         f.write(mode + '\n')
 
+class Job:
+    def __init__(self, name):
+        self.id = secrets.token_hex(6)
+        self.name = name
+        self.status = 'running'
+        self.progress = 0
+        self.message = ''
+        self.result = None
+        self.started = time.time()
+        self.finished = None
+        self.saved = 0
+
+    def update(self, progress=None, message=None):
+        if progress is not None:
+            self.progress = min(progress, 100)
+        if message is not None:
+            self.message = message
+        if time.monotonic() - self.saved > JOB_SAVE_INTERVAL:
+            self.save()
+
+    def save(self):
+        # so /jobs/<id> works whichever worker the poll lands on
+        self.saved = time.monotonic()
+        try:
+            write_shared(f"jobs/{self.id}.json", self.to_dict())
+        except OSError as e:
+            print(f"Could not save job {self.id}: {e}")
+
+    def finish(self, status, message=None):
+        self.status = status
+        if message is not None:
+            self.message = message
+        if status == 'success':
+            self.progress = 100
+        self.finished = time.time()
+        self.save()
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'status': self.status,
+            'progress': self.progress,
+            'message': self.message,
+            'result': self.result,
+            'started': self.started,
+            'finished': self.finished,
+        }
+
+jobs = {}
+jobs_lock = threading.RLock()
+
+def running_job(name):
+    with jobs_lock:
+        for job in jobs.values():
+            if job.name == name and job.status == 'running':
+                return job
+    return None
+
+def create_job(name):
+    job = Job(name)
+    with jobs_lock:
+        finished = [job_id for job_id, old in jobs.items() if old.status != 'running']
+        for job_id in finished[:max(len(finished) - JOB_HISTORY + 1, 0)]:
+            del jobs[job_id]
+            with contextlib.suppress(OSError):
+                os.remove(os.path.join(SHARED_STATE_DIR, 'jobs', f"{job_id}.json"))
+        jobs[job.id] = job
+    job.save()
+    return job
+
+def start_job(name, target, *args):
+    return run_job(create_job(name), target, *args)
+
+def start_single_job(name, target, *args):
+    # check and create in one step, two requests racing here must not start two jobs
+    with jobs_lock:
+        job = running_job(name)
+        if job is not None:
+            return job
+        job = create_job(name)
+    return run_job(job, target, *args)
+
+def run_job(job, target, *args):
+    def run():
+        try:
+            job.result = target(job, *args)
+            job.finish('success')
+        except Exception as e:
+            job.finish('failure', str(e))
+
+    threading.Thread(target=run, daemon=True).start()
+    return job
+
+def pairing_link(mode):
+    conn_state = radio_value('conn_state', mode=mode)
+    link = {'state': conn_state['state'] if conn_state else None}
+    for param in ('ssid', 'bssid'):
+        text = radio_command('get', param, mode=mode)
+        failed = text is None or text.strip() in NO_RESPONSE or text.strip() == HGIC_MISSING
+        link[param] = None if failed else text.strip()
+    return link
+
+def pairing_done(before, link):
+    if link['state'] != CONN_STATE_CONNECTED:
+        return False
+    if before['state'] != CONN_STATE_CONNECTED:
+        return True
+    # already connected before pairing: only a new peer counts
+    return any(before[key] is not None and link[key] is not None and before[key] != link[key]
+               for key in ('ssid', 'bssid'))
+
+def pairing_job(job, mode):
+    # an ap or an associated sta is connected before pairing even starts
+    before = pairing_link(mode)
+    radio_command('set', 'pairing', 1, mode=mode)
+    start = time.monotonic()
+    link = before
+    paired = False
+    try:
+        while time.monotonic() - start < PAIRING_TIMEOUT:
+            time.sleep(PAIRING_POLL_INTERVAL)
+            link = pairing_link(mode)
+            job.update((time.monotonic() - start) / PAIRING_TIMEOUT * 100, f"conn_state {link['state']}")
+            # stop as soon as we joined instead of always sitting out the pairing window
+            if pairing_done(before, link):
+                paired = True
+                break
+    finally:
+        radio_command('set', 'pairing', 0, mode=mode)
+        # pairing rewrites ssid/psk behind our back
+        status_sampler.invalidate()
+    return {'conn_state': link['state'], 'connected': link['state'] == CONN_STATE_CONNECTED, 'paired': paired,
+            'elapsed': time.monotonic() - start}
+
+def ota_path():
+    # same proc root probing as hgpriv: hgicf first, then hgics
+    device = hgpriv.get_device() if hgpriv is not None else None
+    if device is not None:
+        return os.path.join(device.root, "ota")
+    return '/proc/hgicf/ota'
+
+def write_ota(stream, job, total=None, path=None):
+    path = path or ota_path()
+    crc = 0
+    sha = hashlib.sha256()
+    written = 0
+    start = time.monotonic()
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        while True:
+            chunk = stream.read(OTA_CHUNK_SIZE)
+            if not chunk:
+                break
+            # the node may take part of a chunk, keep going until all of it is in
+            view = memoryview(chunk)
+            while view:
+                count = os.write(fd, view)
+                if count <= 0:
+                    raise OSError(errno.EIO, f"ota node accepted nothing after {written} bytes")
+                crc = zlib.crc32(view[:count], crc)
+                sha.update(view[:count])
+                written += count
+                view = view[count:]
+            elapsed = time.monotonic() - start
+            rate = written / elapsed if elapsed > 0 else 0
+            job.update(written / total * 50 if total else None, f"writing firmware, {written} bytes at {rate / 1024:.0f} KiB/s")
+    finally:
+        os.close(fd)
+    elapsed = time.monotonic() - start
+    return {
+        'path': path,
+        'bytes': written,
+        'crc32': f"{crc:08x}",
+        'sha256': sha.hexdigest(),
+        'seconds': elapsed,
+        'bytes_per_second': written / elapsed if elapsed > 0 else 0,
+    }
+
+class MultipartFile:
+    # pulls one file field out of a multipart body as it arrives,
+    # request.files would spool the whole image to a temp file first
+    def __init__(self, stream, boundary, field):
+        self.stream = stream
+        self.decoder = MultipartDecoder(boundary.encode())
+        self.field = field
+        self.filename = None
+        self.reading = False
+        self.eof = False
+        self.complete = False
+
+    def event(self):
+        while True:
+            event = self.decoder.next_event()
+            if event is not NEED_DATA:
+                return event
+            if self.eof:
+                raise ValueError("upload ended before the end of the multipart body")
+            chunk = self.stream.read(OTA_CHUNK_SIZE)
+            if not chunk:
+                self.eof = True
+            self.decoder.receive_data(chunk or None)
+
+    def open(self):
+        # skips to the file field, False if the form does not have it
+        while True:
+            event = self.event()
+            if isinstance(event, File) and event.name == self.field:
+                self.filename = event.filename
+                self.reading = True
+                return True
+            if isinstance(event, Epilogue):
+                self.complete = True
+                return False
+
+    def read(self, size=-1):
+        while self.reading:
+            event = self.event()
+            if isinstance(event, Data):
+                self.reading = event.more_data
+                if event.data:
+                    return event.data
+        return b''
+
+    def finish(self):
+        # the image only counts once the closing boundary arrived
+        while not self.complete:
+            if isinstance(self.event(), Epilogue):
+                self.complete = True
+
+def firmware_reboot_job(job, ota_result, ota_lock=None):
+    try:
+        start = time.monotonic()
+        while time.monotonic() - start < OTA_REBOOT_DELAY:
+            job.update(50 + (time.monotonic() - start) / OTA_REBOOT_DELAY * 50, 'waiting for the module to flash')
+            time.sleep(1)
+        job.update(100, 'rebooting')
+        run_command("reboot")
+        return ota_result
+    finally:
+        if ota_lock is not None:
+            os.close(ota_lock)
+
 @app.route('/')
 def index():
-    mode = load_mode()
-    if mode == 'hgpriv':
-        current_settings = {param: run_command(f"/sbin/hgpriv hg0 get {param}").strip() for param in ['ssid', 'bssid', 'txpower', 'bss_bw', 'conn_state']}
-    elif mode == 'libnetat':
-        current_settings = {param: run_libnetat_command(f"{param}", 'get').strip() for param in ['ssid', 'bssid', 'txpower', 'bss_bw', 'conn_state']}
-    current_network_settings = get_current_network_settings()
-    return render_template_string(HTML_TEMPLATE, set_commands=SET_COMMANDS, get_commands=GET_COMMANDS, current_settings=current_settings, current_network_settings=current_network_settings)
+    status = status_sampler.get()
+    return render_template_string(HTML_TEMPLATE, set_commands=SET_COMMANDS, get_commands=GET_COMMANDS, current_settings=status['settings'], current_network_settings=status['network'])
+
+@app.route('/status', methods=['GET'])
+def handle_status():
+    status = status_sampler.get()
+    return jsonify({"status": "success", **status, "age": time.monotonic() - status_sampler.updated})
+
+@app.route('/stream', methods=['GET'])
+def handle_stream():
+    ifname = request.args.get('ifname', IFNAME)
+    if not interface_exists(ifname):
+        return jsonify({"status": "failure", "error": "invalid interface"})
+    return link_stream(ifname)
+
+@app.route('/history', methods=['GET'])
+def handle_history():
+    metric = request.args.get('metric', 'signal')
+    try:
+        end = float(request.args.get('to') or time.time())
+        start = float(request.args.get('from') or end - 3600)
+        step = float(request.args['step']) if request.args.get('step') else None
+    except ValueError:
+        return jsonify({"status": "failure", "error": "from, to and step must be numbers"})
+    store = get_history_store()
+    if store is None:
+        return jsonify({"status": "failure", "error": "history is not available"})
+    try:
+        resolution, step, points = store.query(metric, start, end, step)
+    except ValueError as e:
+        return jsonify({"status": "failure", "error": str(e)})
+    return jsonify({"status": "success", "metric": metric, "from": start, "to": end, "step": step,
+                    "resolution": resolution, "points": points, "metrics": store.metrics()})
+
+def metric_gauges():
+    # cached samples only, a scrape never reaches the radio
+    gauges = []
+    now = time.time()
+    samplers = [('link', get_link_sampler()), ('telemetry', telemetry_sampler), ('stations', station_sampler)]
+    for name, sampler in samplers:
+        sampler.start()
+        sampler.load_shared()
+        data = sampler.data
+        if not data:
+            continue
+        gauges.append(('taixin_sample_age_seconds', (('sampler', name),), round(now - data['time'], 3)))
+        if name == 'link':
+            if data['signal'] is not None:
+                gauges.append(('taixin_signal_dbm', (), data['signal']))
+            if data['conn_state'] is not None and hgpriv is not None:
+                for state in range(CONN_STATE_CONNECTED + 1):
+                    gauges.append(('taixin_conn_state', (('state', hgpriv.hgic_hw_state(state)),), int(state == data['conn_state'])))
+        elif name == 'telemetry':
+            for param in TELEMETRY_PARAMS:
+                if data[param] is not None:
+                    gauges.append((f"taixin_{param}", (), data[param]))
+        elif data['sta_count'] is not None:
+            gauges.append(('taixin_sta_count', (), data['sta_count']))
+    return gauges
+
+def broker_counters():
+    if hgpriv is None:
+        return []
+    broker = hgpriv.iwpriv_broker
+    if broker.pid != os.getpid():
+        # nothing submitted in this process yet, whatever is there was counted by the parent
+        return []
+    return [('taixin_iwpriv_calls_total', (), broker.calls), ('taixin_iwpriv_coalesced_total', (), broker.coalesced),
+            ('taixin_iwpriv_errors_total', (), broker.errors), ('taixin_iwpriv_timeouts_total', (), broker.timeouts)]
+
+metrics.sources.append(broker_counters)
+
+@app.route('/metrics', methods=['GET'])
+def handle_metrics():
+    return Response(metrics.render(metric_gauges(), shared=WORKERS > 1), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/debug/trace', methods=['GET', 'POST'])
+def handle_trace():
+    # POST enable=1|0 and/or clear=1, GET the spans, or format=chrome for chrome://tracing / perfetto
+    if request.method == 'POST':
+        if request.values.get('enable') is not None:
+            tracing.enable(request.values.get('enable') == '1')
+        if request.values.get('clear') == '1':
+            tracing.clear()
+    if request.args.get('format') == 'chrome':
+        return Response(json.dumps(tracing.chrome_trace()), mimetype='application/json',
+                        headers={'Content-Disposition': 'attachment; filename=taixin_trace.json'})
+    try:
+        limit = int(request.args.get('limit') or 200)
+    except ValueError:
+        return jsonify({"status": "failure", "error": "limit must be a number"})
+    return jsonify({"status": "success", "enabled": tracing.enabled, "summary": tracing.summary(),
+                    "spans": tracing.snapshot(limit)})
+
+@app.route('/stations', methods=['GET'])
+def handle_stations():
+    return jsonify({"status": "success", **station_sampler.get()})
+
+@app.route('/stations/stream', methods=['GET'])
+def handle_stations_stream():
+    return sse_stream(station_sampler)
+
+@app.route('/survey', methods=['GET', 'POST'])
+def handle_survey():
+    # GET returns what changed since the given version, POST scans first
+    try:
+        since = int(request.values.get('since') or 0)
+    except ValueError:
+        return jsonify({"status": "failure", "error": "since must be a number"})
+    if request.method == 'POST':
+        site_survey.scan()
+    return jsonify({"status": "success", **site_survey.delta(since)})
+
+def netlog_args():
+    device = request.args.get('device') or None
+    since = request.args.get('since')
+    if device is not None and not re.fullmatch(r'[0-9a-fA-F:.]{7,17}', device):
+        raise ValueError("invalid device")
+    return device and device.lower(), int(since) if since else None
+
+@app.route('/netlog', methods=['GET'])
+def handle_netlog():
+    try:
+        device, since = netlog_args()
+        limit = int(request.args.get('limit') or NETLOG_LIMIT)
+    except ValueError as e:
+        return jsonify({"status": "failure", "error": str(e)})
+    collector = get_netlog_collector()
+    if collector is None:
+        return jsonify({"status": "failure", "error": "netlog is not available"})
+    entries = collector.entries(device, since or 0, limit)
+    return jsonify({"status": "success", "entries": entries, "devices": collector.devices(),
+                    "seq": entries[-1]['seq'] if entries else since or 0})
+
+@app.route('/netlog/stream', methods=['GET'])
+def handle_netlog_stream():
+    try:
+        device, since = netlog_args()
+    except ValueError as e:
+        return jsonify({"status": "failure", "error": str(e)})
+    collector = get_netlog_collector()
+    if collector is None:
+        return jsonify({"status": "failure", "error": "netlog is not available"})
+    subscriber, backlog = collector.subscribe(device, since)
+    return sse_response(collector, subscriber, backlog)
 
 @app.route('/command', methods=['GET'])
 def handle_command():
     cmd_type = request.args.get('cmd')
     param = request.args.get('param')
     value = request.args.get('value')
+    fmt = request.args.get('format')
 
     mode = load_mode()
-    if mode == 'hgpriv':
-        if cmd_type == 'get':
-            command = f"/sbin/hgpriv hg0 get {param}"
-        elif cmd_type == 'set':
-            command = f"/sbin/hgpriv hg0 set {param}={value}"
-        else:
-            return jsonify({"response": "Invalid command type"})
-        output = run_command(command)
-    elif mode == 'libnetat':
-        # Remap command if necessary
-        if param in COMMAND_REMAP:
-            param = COMMAND_REMAP[param]
-        if cmd_type == 'get':
-            command = f"{param}?"
-        elif cmd_type == 'set':
-            command = f"{param}={value}"
-        else:
-            return jsonify({"response": "Invalid command type"})
-        output = run_libnetat_command(command, cmd_type)
-    else:
+    if mode not in MODES:
         return jsonify({"response": "Invalid mode"})
-
+    if cmd_type not in ('get', 'set'):
+        return jsonify({"response": "Invalid command type"})
+    if fmt and fmt not in OUTPUT_FORMATS:
+        return jsonify({"status": "failure", "error": f"format must be one of {', '.join(OUTPUT_FORMATS)}"})
+    if fmt and mode != 'hgpriv':
+        return jsonify({"status": "failure", "error": "format is only supported in hgpriv mode"})
+    if cmd_type == 'get' and param in STATUS_PARAMS and not fmt:
+        output = status_sampler.get()['settings'][param]
+    else:
+        output = radio_command(cmd_type, param, value, mode=mode, fmt=fmt)
+    if cmd_type == 'get' and mode == 'hgpriv' and hgpriv is not None and (param in hgpriv.BINARY_GETS or fmt in ('hex', 'base64')):
+        # encoded replies are not parsed, a hex string would read as a number
+        return jsonify({"response": output, "format": fmt or 'hex'})
+    if cmd_type == 'get':
+        return jsonify({"response": output, "value": parse_response(param, output)})
     return jsonify({"response": output})
 
+@app.route('/command/batch', methods=['POST'])
+def handle_command_batch():
+    data = request.json
+    ops = data.get('ops') if isinstance(data, dict) else data
+    if not isinstance(ops, list) or not ops or len(ops) > BATCH_MAX_OPS:
+        return jsonify({"status": "failure", "error": f"expected a list of 1 to {BATCH_MAX_OPS} operations"})
+    for op in ops:
+        if not isinstance(op, dict) or op.get('cmd') not in ('get', 'set') or not op.get('param'):
+            return jsonify({"status": "failure", "error": "every operation needs cmd get/set and a param"})
+    mode = load_mode()
+    if mode not in MODES:
+        return jsonify({"status": "failure", "error": "Invalid mode"})
+    start = time.monotonic()
+    results = run_command_batch(ops, mode)
+    return jsonify({"status": "success", "results": results, "elapsed_ms": (time.monotonic() - start) * 1000})
+
+@app.route('/fleet', methods=['POST'])
+def handle_fleet():
+    data = request.json or {}
+    if not isinstance(data, dict):
+        return jsonify({"status": "failure", "error": "expected a json object"})
+    if data.get('command'):
+        if not isinstance(data['command'], str) or not data['command'].strip():
+            return jsonify({"status": "failure", "error": "command must be a non-empty string"})
+        commands = [data['command']]
+    elif data.get('config'):
+        if not isinstance(data['config'], dict):
+            return jsonify({"status": "failure", "error": "config must be an object"})
+        for key, value in data['config'].items():
+            # each pair becomes one AT line, nothing may break out of it
+            if not re.fullmatch(r'\w+', key):
+                return jsonify({"status": "failure", "error": f"invalid config key {key!r}"})
+            if isinstance(value, bool) or not isinstance(value, (str, int, float)) or re.search(r'[\r\n]', str(value)):
+                return jsonify({"status": "failure", "error": f"invalid value for {key}"})
+        commands = [f"at+{key}={value}" for key, value in data['config'].items()]
+    else:
+        return jsonify({"status": "failure", "error": "command or config required"})
+    devices = None
+    if data.get('devices'):
+        macs = data['devices']
+        if not isinstance(macs, list):
+            return jsonify({"status": "failure", "error": "devices must be a list"})
+        for mac in macs:
+            if not isinstance(mac, str) or not MAC_RE.fullmatch(mac):
+                return jsonify({"status": "failure", "error": f"invalid MAC address {mac!r}"})
+        devices = [bytes.fromhex(mac.replace(':', '')) for mac in macs]
+    session = get_netat_session()
+    if session is None:
+        return jsonify({"status": "failure", "error": "libnetat session unavailable"})
+    report = session.fleet(commands, devices)
+    return jsonify({"status": "success", **report})
+
 @app.route('/station_settings', methods=['POST'])
 def save_station_settings():
     settings = request.json
@@ -907,21 +2783,16 @@ def handle_load_station_settings():
 @app.route('/apply_last_settings', methods=['GET'])
 def apply_last_settings():
     settings = load_last_settings()
-    apply_settings(settings)
-    return jsonify({"status": "success"})
+    report = apply_settings(settings, force=request.args.get('force') == '1')
+    return jsonify({"status": "success", "report": report})
 
 @app.route('/quick_pair', methods=['POST'])
 def quick_pair():
     mode = load_mode()
-    if mode == 'hgpriv':
-        run_command("/sbin/hgpriv hg0 set pairing=1")
-        time.sleep(20)
-        run_command("/sbin/hgpriv hg0 set pairing=0")
-    elif mode == 'libnetat':
-        run_libnetat_command("pairing=1", 'set')
-        time.sleep(20)
-        run_libnetat_command("pairing=0", 'set')
-    return jsonify({"status": "success"})
+    if mode not in MODES:
+        return jsonify({"status": "failure"})
+    job = start_single_job('quick_pair', pairing_job, mode)
+    return jsonify({"status": "success", "job": job.id})
 
 @app.route('/reboot', methods=['POST'])
 def reboot_system():
@@ -953,29 +2824,81 @@ def handle_save_wifi_settings():
 
 @app.route('/upload_firmware', methods=['POST'])
 def upload_firmware():
-    if 'firmware' not in request.files:
-        return redirect(request.url)
-    file = request.files['firmware']
-    if file.filename == '':
+    # the image is piped straight into the ota node, either as a raw request body
+    # (?filename=x.bin) or from a multipart form field
+    upload = None
+    total = request.content_length
+    if request.mimetype == 'application/octet-stream':
+        filename = request.args.get('filename', '')
+        stream = request.stream
+    elif request.mimetype == 'multipart/form-data' and request.mimetype_params.get('boundary'):
+        upload = MultipartFile(request.stream, request.mimetype_params['boundary'], 'firmware')
+        try:
+            if not upload.open():
+                return redirect(request.url)
+        except Exception as e:
+            return jsonify({"status": "failure", "error": str(e)})
+        filename = upload.filename or ''
+        stream = upload
+    else:
         return redirect(request.url)
-    if file and allowed_file(file.filename):
-        filename = secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
-        with open(filepath, 'rb') as f:
-            firmware_data = f.read()
-        with open('/proc/hgicf/ota', 'wb') as f:
-            f.write(firmware_data)
-        time.sleep(30)
-        run_command("reboot")
-        return jsonify({"status": "success"})
-    return jsonify({"status": "failure"})
+    if filename == '' or not allowed_file(filename):
+        return jsonify({"status": "failure", "error": "firmware must be a .bin file"})
+    # one image at a time: two uploads would interleave in the ota node and both reboot.
+    # the lock covers the other workers and is held until the reboot job ends
+    ota_lock = try_shared_lock('ota')
+    job = None
+    if ota_lock is not None:
+        with jobs_lock:
+            if running_job('upload_firmware') is None:
+                job = create_job('upload_firmware')
+    if job is None:
+        if ota_lock is not None:
+            os.close(ota_lock)
+        return jsonify({"status": "failure", "error": "another firmware upload is in progress"})
+    job.update(0, f"writing {secure_filename(filename)}")
+    try:
+        ota_result = write_ota(stream, job, total)
+        if upload is not None:
+            upload.finish()
+    except Exception as e:
+        # a client that goes away mid upload lands here too, never reboot on a partial image
+        os.close(ota_lock)
+        job.finish('failure', str(e) or type(e).__name__)
+        return jsonify({"status": "failure", "error": str(e), "job": job.id})
+    if upload is None and total is not None and ota_result['bytes'] != total:
+        os.close(ota_lock)
+        error = f"short write: {ota_result['bytes']} of {total} bytes"
+        job.finish('failure', error)
+        return jsonify({"status": "failure", "error": error, "job": job.id})
+    run_job(job, firmware_reboot_job, ota_result, ota_lock)
+    return jsonify({"status": "success", "job": job.id, "ota": ota_result})
+
+@app.route('/jobs', methods=['GET'])
+def list_jobs():
+    with jobs_lock:
+        return jsonify({"status": "success", "jobs": [job.to_dict() for job in jobs.values()]})
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = jobs.get(job_id)
+    if job is not None:
+        return jsonify({"status": "success", "job": job.to_dict()})
+    if re.fullmatch(r'[0-9a-f]+', job_id):
+        _, shared = read_shared(f"jobs/{job_id}.json")
+        if shared is not None:
+            return jsonify({"status": "success", "job": shared})
+    return jsonify({"status": "failure", "error": "unknown job"}), 404
 
 @app.route('/switch_mode', methods=['POST'])
 def switch_mode():
     mode = request.json.get('mode')
+    if mode == 'libnetat' and WORKERS > 1:
+        # the netat session owns udp port 56789, only one worker could bind it
+        return jsonify({"status": "failure", "error": "libnetat mode needs a single worker, restart with --workers 1"})
     if mode in MODES:
         save_mode(mode)
+        status_sampler.invalidate()
         return jsonify({"status": "success"})
     return jsonify({"status": "failure"})
 
@@ -984,9 +2907,73 @@ def load_mode_route():
     mode = load_mode()
     return jsonify({"status": "success", "mode": mode})
 
-if __name__ == '__main__':
+def start_samplers():
+    # keep the history samplers running even with no dashboard open. every named sampler has
+    # to run in the leader from the start, followers only ever read what it shares
+    get_link_sampler().start()
+    telemetry_sampler.start()
+    status_sampler.start()
+    station_sampler.start()
+
+def serve_production(host, port, workers, threads):
+    global WORKERS
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        print("--production needs gunicorn, install it with: pip install gunicorn")
+        sys.exit(1)
+
+    if workers > 1 and load_mode() == 'libnetat':
+        # the netat session owns udp port 56789, only one process can hold it
+        print("libnetat mode only supports one worker, use --threads instead")
+        workers = 1
+    WORKERS = workers
+
+    class ProductionApplication(BaseApplication):
+        def load_config(self):
+            self.cfg.set('bind', f"{host}:{port}")
+            self.cfg.set('workers', workers)
+            self.cfg.set('worker_class', 'gthread')
+            self.cfg.set('threads', threads)
+            self.cfg.set('keepalive', 5)
+            self.cfg.set('post_worker_init', lambda worker: start_worker())
+
+        def load(self):
+            return app
+
+    def start_worker():
+        start_samplers()
+        if workers > 1:
+            metrics.start_sharing()
+            # the leader has to be collecting before another worker serves /netlog from the journal
+            get_netlog_collector()
+
+    # sockets and threads must not be shared with the forked workers
+    close_netat_sessions()
+    ProductionApplication().run()
+
+def main():
+    parser = argparse.ArgumentParser(description="Taixin Tool web gui")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--production', action='store_true', help="serve with gunicorn instead of the flask development server")
+    parser.add_argument('--workers', type=int, default=1, help="worker processes in production mode")
+    parser.add_argument('--threads', type=int, default=16, help="threads per worker in production mode")
+    parser.add_argument('--trace', action='store_true', help="record backend timings, see /debug/trace")
+    args = parser.parse_args()
+
+    if args.trace:
+        tracing.enable()
+
     last_settings = load_last_settings()
     if last_settings:
-        apply_settings(last_settings)
-    app.run(host='0.0.0.0', port=8080)
+        report = apply_settings(last_settings)
+        print(f"Applied last settings: {len(report['changed'])} changed, {len(report['unverified'])} unverified, {len(report['unchanged'])} unchanged")
+    if args.production:
+        serve_production(args.host, args.port, args.workers, args.threads)
+    else:
+        start_samplers()
+        app.run(host=args.host, port=args.port, threaded=True)
 
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+import os
+import threading
+import time
+from collections import deque
+
+# opt-in: TAIXIN_TRACE=1 in the environment, server.py --trace, or enable() at runtime
+TRACE_BUFFER_SIZE = 20000  # spans kept, the oldest are dropped first
+# perf_counter for durations, shifted onto the wall clock for the trace timestamps
+WALL_OFFSET = time.time() - time.perf_counter()
+
+enabled = os.environ.get('TAIXIN_TRACE') == '1'
+events = deque(maxlen=TRACE_BUFFER_SIZE)
+
+class Span:
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter()
+        if exc_type is not None:
+            self.args['error'] = exc_type.__name__
+        events.append({
+            'name': self.name,
+            'ph': 'X',
+            'ts': (self.start + WALL_OFFSET) * 1e6,
+            'dur': (end - self.start) * 1e6,
+            'pid': os.getpid(),
+            'tid': threading.get_ident(),
+            'args': self.args,
+        })
+        return False
+
+class NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+NULL_SPAN = NullSpan()
+
+def span(name, **args):
+    # with tracing off this is one global lookup and a shared no-op context manager
+    if not enabled:
+        return NULL_SPAN
+    return Span(name, args)
+
+def mark(name, **args):
+    if not enabled:
+        return
+    events.append({
+        'name': name,
+        'ph': 'i',
+        's': 't',
+        'ts': (time.perf_counter() + WALL_OFFSET) * 1e6,
+        'pid': os.getpid(),
+        'tid': threading.get_ident(),
+        'args': args,
+    })
+
+def enable(on=True):
+    global enabled
+    enabled = on
+
+def clear():
+    events.clear()
+
+def snapshot(limit=None):
+    spans = list(events)
+    return spans[-limit:] if limit else spans
+
+def summary():
+    stats = {}
+    for event in list(events):
+        if event['ph'] != 'X':
+            continue
+        entry = stats.get(event['name'])
+        if entry is None:
+            entry = stats[event['name']] = {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0}
+        ms = event['dur'] / 1000
+        entry['count'] += 1
+        entry['total_ms'] += ms
+        entry['max_ms'] = max(entry['max_ms'], ms)
+    for entry in stats.values():
+        entry['avg_ms'] = round(entry['total_ms'] / entry['count'], 3)
+        entry['total_ms'] = round(entry['total_ms'], 3)
+        entry['max_ms'] = round(entry['max_ms'], 3)
+    return stats
+
+def chrome_trace():
+    # loads in chrome://tracing or https://ui.perfetto.dev
+    return {'traceEvents': snapshot(), 'displayTimeUnit': 'ms'}